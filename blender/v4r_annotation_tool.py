@@ -287,6 +287,30 @@ class V4R_OT_align_object(bpy.types.Operator):
         return {'FINISHED'}
 
 
+class V4R_OT_global_align_object(bpy.types.Operator):
+    """ Place selected object by matching features with the scene, then align. """
+
+    bl_idname = "v4r.global_align_object"
+    bl_label = "Global Align"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(self, context):
+        global SCENE_FILE_READER
+        global SCENE_MESH
+        return (v4r_blender_utils.has_active_object_id() and context.area.type == 'VIEW_3D' and
+                SCENE_FILE_READER and SCENE_MESH)
+
+    def execute(self, context):
+        global SCENE_FILE_READER
+        global SCENE_MESH
+        bpy.context.window.cursor_set("WAIT")
+        v4r_blender_utils.global_align_current_object(
+            SCENE_FILE_READER, SCENE_MESH, context.scene.v4r_infos.scene_id)
+        bpy.context.window.cursor_set("DEFAULT")
+        return {'FINISHED'}
+
+
 class V4R_OT_import_reconstruction(bpy.types.Operator):
     """ Import reconstruction of scene. """
 
@@ -362,6 +386,7 @@ class V4R_PT_annotation(bpy.types.Panel):
         col.separator()
 
         col.operator("v4r.align_object")
+        col.operator("v4r.global_align_object")
 
         col.separator()
 
@@ -480,6 +505,7 @@ def register():
     bpy.utils.register_class(V4R_OT_import_scene)
     bpy.utils.register_class(V4R_OT_save_pose)
     bpy.utils.register_class(V4R_OT_align_object)
+    bpy.utils.register_class(V4R_OT_global_align_object)
     bpy.utils.register_class(V4R_OT_import_reconstruction)
     bpy.utils.register_class(V4R_OT_add_object)
     bpy.utils.register_class(V4R_UL_object_selector)
@@ -505,6 +531,7 @@ def unregister():
     bpy.utils.unregister_class(V4R_OT_import_scene)
     bpy.utils.unregister_class(V4R_OT_save_pose)
     bpy.utils.unregister_class(V4R_OT_align_object)
+    bpy.utils.unregister_class(V4R_OT_global_align_object)
     bpy.utils.unregister_class(V4R_OT_import_reconstruction)
     bpy.utils.unregister_class(V4R_OT_add_object)
     bpy.utils.unregister_class(V4R_UL_object_selector)
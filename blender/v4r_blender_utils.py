@@ -129,7 +129,7 @@ def set_alpha(value=0):
 def load_cameras(SCENE_FILE_READER, id):
     # Removing cameras based on collection rather than name
     # Could still use generated name to make sure
-    camera_poses = SCENE_FILE_READER.get_camera_poses(id)
+    _, camera_poses = SCENE_FILE_READER.get_camera_poses_array(id)
     groundtruth_to_blender = np.array([[1, 0, 0, 0],
                                        [0, -1, 0, 0],
                                        [0, 0, -1, 0],
@@ -155,10 +155,13 @@ def load_cameras(SCENE_FILE_READER, id):
     # rgb.sort()
 
     rgb = SCENE_FILE_READER.get_images_rgb_path(id)
+    # using blender camera with focal length in millimeters
+    camera_info = SCENE_FILE_READER.get_camera_info_scene(id)
 
     # no active object
     bpy.ops.object.select_all(action='DESELECT')
-    if camera_poses:
+    camera_poses = camera_poses @ groundtruth_to_blender
+    if len(camera_poses):
         if "cameras" not in bpy.data.collections:
             cam_collection = bpy.ops.collection.create(name="cameras")
             bpy.context.scene.collection.children.link(
@@ -172,14 +175,12 @@ def load_cameras(SCENE_FILE_READER, id):
         else:
             cam = bpy.data.cameras.new(name)
             obj_camera = bpy.data.objects.new(name, cam)
-            camera_pose = camera_poses[i].tf.dot(groundtruth_to_blender)
+            camera_pose = camera_poses[i]
             location = camera_pose[:3, -1]
             rotation = camera_pose[:3, :3]
             obj_camera.location = [location[0], location[1], location[2]]
             obj_camera.rotation_euler = mathutils.Matrix(rotation).to_euler()
 
-            # using blender camera with focal length in millimeters
-            camera_info = SCENE_FILE_READER.get_camera_info_scene(id)
             if camera_info.sensor_width:
                 obj_camera.data.lens_unit = 'MILLIMETERS'
                 obj_camera.data.lens = camera_info.lens()
@@ -256,7 +257,9 @@ def load_reconstruction_visual(SCENE_FILE_READER, id):
 
     remove_reconstruction_visual()
 
-    new_m = SCENE_FILE_READER.get_reconstruction_visual(id)
+    # a coarser level keeps the viewport responsive on large scenes
+    new_m = SCENE_FILE_READER.get_reconstruction_visual_lod(
+        id, SCENE_FILE_READER.reconstruction_visual_max_triangles)
     if(new_m):
         print("Creating new reconstruction mesh.")
         mesh = new_m.as_bpy_mesh()
@@ -279,10 +282,36 @@ def align_current_object(SCENE_FILE_READER, SCENE_MESH):
         current_id = active["v4r_id"]
         print(f"Align object {current_id}")
         current_pose = active.matrix_world
-        current_mesh = SCENE_FILE_READER.object_library[current_id].mesh.as_o3d(
-        )
-        pose, info = autoalign.auto_align(
-            current_mesh, SCENE_MESH, init_pose=current_pose)
+        object_data = SCENE_FILE_READER.object_library.get_object_data(
+            current_id)
+        sphere = object_data.bounding_sphere()
+        # small perturbations of the current placement, so a rough start needs
+        # fewer clicks, flips are left out to keep symmetric objects as placed
+        hypotheses = autoalign.pose_hypotheses(
+            np.asarray(current_pose), sphere[0], count=16, flips=False)
+        results = autoalign.align_hypotheses(
+            None, SCENE_MESH, hypotheses,
+            source_pcd=object_data.samples(10000), sphere=sphere)
+        best = results[0]
+        print(f"Fitness {best['fitness']:.3f} rmse {best['rmse']:.5f}")
+        active.matrix_world = mathutils.Matrix(best['pose'])
+
+
+def global_align_current_object(SCENE_FILE_READER, SCENE_MESH, scene_id):
+    if has_active_object_id():
+        active = bpy.context.active_object
+        current_id = active["v4r_id"]
+        print(f"Global align object {current_id}")
+        object_data = SCENE_FILE_READER.object_library.get_object_data(
+            current_id)
+        # features of scene and object are cached, only matching runs here
+        pose, info, coarse = autoalign.global_align(
+            None, SCENE_MESH,
+            source_pcd=object_data.samples(10000),
+            source_features=object_data.features(),
+            target_features=SCENE_FILE_READER.get_reconstruction_align_features(scene_id),
+            sphere=object_data.bounding_sphere())
+        print(f"Coarse fitness {coarse.fitness:.3f}")
         active.matrix_world = mathutils.Matrix(pose)
 
 
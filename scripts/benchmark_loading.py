@@ -0,0 +1,88 @@
+import argparse
+import numpy as np
+import open3d as o3d
+import os
+import tempfile
+import time
+import yaml
+import v4r_dataset_toolkit as v4r
+
+
+def create_synthetic_scene(root, frames, width, height):
+    scene_dir = os.path.join(root, "scenes", "synthetic")
+    os.makedirs(os.path.join(scene_dir, "rgb"))
+    os.makedirs(os.path.join(scene_dir, "depth"))
+    os.makedirs(os.path.join(root, "objects"))
+
+    with open(os.path.join(root, "objects", "objects.yaml"), 'w') as fp:
+        yaml.dump([], fp)
+
+    with open(os.path.join(root, "dataset.yaml"), 'w') as fp:
+        yaml.dump({"General": {"scenes_dir": "scenes",
+                               "rgb_dir": "rgb",
+                               "depth_dir": "depth",
+                               "object_library_file": "objects/objects.yaml"}}, fp)
+
+    # smooth gradients plus noise compress like real recordings
+    rng = np.random.default_rng(0)
+    u, v = np.meshgrid(np.arange(width), np.arange(height))
+    for i in range(frames):
+        base = (u + v + 7 * i) % 256
+        noise = rng.integers(0, 16, size=(height, width, 3))
+        rgb = ((base[..., None] + noise) % 256).astype(np.uint8)
+        depth = (800 + (u * 3 + v * 5 + i) % 400 +
+                 rng.integers(0, 4, size=(height, width))).astype(np.uint16)
+        o3d.io.write_image(os.path.join(scene_dir, "rgb", f"{i:06d}.png"),
+                           o3d.geometry.Image(rgb))
+        o3d.io.write_image(os.path.join(scene_dir, "depth", f"{i:06d}.png"),
+                           o3d.geometry.Image(depth))
+
+    return os.path.join(root, "dataset.yaml")
+
+
+def load_scene(scene_file_reader, pool):
+    scene_file_reader.decode_pool = pool
+    start = time.perf_counter()
+    n_frames = 0
+    for rgb, depth in scene_file_reader.get_frames_rgbd("synthetic"):
+        n_frames += 1
+    return time.perf_counter() - start, n_frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Compare serial and parallel image loading on a synthetic scene.")
+    parser.add_argument("--frames", type=int, default=100,
+                        help="Number of rgb/depth frames to generate.")
+    parser.add_argument("--width", type=int, default=1280,
+                        help="Image width.")
+    parser.add_argument("--height", type=int, default=720,
+                        help="Image height.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of decode workers.")
+    parser.add_argument("--read_ahead", type=int, default=None,
+                        help="Number of frames decoded ahead.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Repetitions per configuration.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        print("Creating synthetic scene")
+        dataset_file = create_synthetic_scene(
+            root, args.frames, args.width, args.height)
+        scene_file_reader = v4r.io.SceneFileReader.create(dataset_file)
+        pool = v4r.frames.DecodePool(args.workers, args.read_ahead)
+
+        results = {}
+        for name, current_pool in [("serial", None), ("parallel", pool)]:
+            times = []
+            for _ in range(args.repeat):
+                elapsed, n_frames = load_scene(scene_file_reader, current_pool)
+                times.append(elapsed)
+            results[name] = min(times)
+            print(f"{name:>8}: {results[name]:.3f}s for {n_frames} frames "
+                  f"({n_frames / results[name]:.1f} frames/s)")
+        pool.shutdown()
+
+        print(f"workers: {pool.workers}, read_ahead: {pool.read_ahead}, "
+              f"speedup: {results['serial'] / results['parallel']:.2f}x")
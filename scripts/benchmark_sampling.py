@@ -0,0 +1,57 @@
+import argparse
+import numpy as np
+import open3d as o3d
+import os
+import time
+import v4r_dataset_toolkit as v4r
+
+
+def spacing(pcd):
+    distances = np.asarray(pcd.compute_nearest_neighbor_distance())
+    return distances.mean(), distances.std(), np.percentile(distances, 5)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Compare time and point spacing of the alignment cloud samplers.")
+    parser.add_argument("-d", "--dataset", type=str, default=None,
+                        help="Path to dataset configuration, uses reconstruction.ply of the scene.")
+    parser.add_argument("--scene_id", type=str, default=None,
+                        help="Scene identifier.")
+    parser.add_argument("--mesh", type=str, default=None,
+                        help="Mesh file, a synthetic mesh is used if no mesh or scene is given.")
+    parser.add_argument("--voxel_size", type=float, default=0.003,
+                        help="Voxel size in meter for the voxel and area samplers.")
+    parser.add_argument("--points", type=int, default=500000,
+                        help="Number of points for poisson sampling.")
+    parser.add_argument("--samplers", nargs='*', type=str,
+                        default=list(v4r.sampling.ALIGN_SAMPLERS),
+                        help="Samplers to compare.")
+    args = parser.parse_args()
+
+    if args.dataset:
+        scene_file_reader = v4r.io.SceneFileReader.create(args.dataset)
+        mesh_file = os.path.join(scene_file_reader.reconstruction_dir,
+                                 args.scene_id,
+                                 scene_file_reader.reconstruction_file)
+        mesh = o3d.io.read_triangle_mesh(mesh_file)
+    elif args.mesh:
+        mesh = o3d.io.read_triangle_mesh(args.mesh)
+    else:
+        # a table sized sphere with about 2M triangles
+        mesh = o3d.geometry.TriangleMesh.create_sphere(radius=0.5, resolution=1000)
+    mesh.compute_vertex_normals()
+    print(f"Mesh: {len(mesh.vertices)} vertices, {len(mesh.triangles)} triangles, "
+          f"area {mesh.get_surface_area():.3f} m^2")
+
+    print(f"{'sampler':>8} {'time':>8} {'points':>9} {'spacing mean':>13} "
+          f"{'std':>8} {'5%':>8}")
+    for sampler in args.samplers:
+        start = time.perf_counter()
+        pcd = v4r.sampling.create_align_cloud(mesh, sampler,
+                                              voxel_size=args.voxel_size,
+                                              number_of_points=args.points)
+        elapsed = time.perf_counter() - start
+        mean, std, low = spacing(pcd)
+        print(f"{sampler:>8} {elapsed:>7.2f}s {len(pcd.points):>9} "
+              f"{mean * 1000:>11.2f}mm {std * 1000:>6.2f}mm {low * 1000:>6.2f}mm")
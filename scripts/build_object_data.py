@@ -0,0 +1,36 @@
+import argparse
+import os
+import v4r_dataset_toolkit as v4r
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Precompute samples, normals, bounds and LOD meshes of library objects.")
+    parser.add_argument("-d", "--dataset", type=str, default="./dataset.yaml",
+                        help="Path to dataset configuration.")
+    parser.add_argument("--ids", nargs='*', type=str, default=None,
+                        help="Object identifiers, all objects if omitted.")
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild even if the stored data is up to date.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.dataset):
+        print(f"The config {args.dataset} file does not exist.")
+        os.sys.exit(1)
+
+    scene_file_reader = v4r.io.SceneFileReader.create(args.dataset)
+    object_library = scene_file_reader.object_library
+
+    diff = [x for x in args.ids or [] if x not in object_library]
+    if diff:
+        print("Error: The following objects are not part of the library:")
+        print(diff)
+        os.sys.exit(1)
+
+    for obj in object_library.as_list(args.ids):
+        if not obj.mesh:
+            print(f"Skipping object {obj.id} without mesh.")
+            continue
+        print(f"Processing object: {obj.id}")
+        object_library.get_object_data(obj.id).build(force=args.force)
+    print("Finished")
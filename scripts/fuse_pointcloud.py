@@ -0,0 +1,56 @@
+import argparse
+import os
+import v4r_dataset_toolkit as v4r
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Fuse all depth frames of a scene into one voxelized point cloud.")
+    parser.add_argument("-d", "--dataset", type=str, default="./dataset.yaml",
+                        help="Path to dataset configuration.")
+    parser.add_argument("--scene_id", nargs='*', type=str, default=None,
+                        help="Scene identifier.")
+    parser.add_argument("--voxel_size", type=float, default=0.004,
+                        help="Voxel size in meter.")
+    parser.add_argument("--stride", type=int, default=1,
+                        help="Use every n-th pixel in both image directions.")
+    parser.add_argument("--max_depth", type=float, default=1.3,
+                        help="Set max depth in meter.")
+    parser.add_argument("--align", action="store_true",
+                        help="Write the cloud as alignment target of the scene.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.dataset):
+        print(f"The config {args.dataset} file does not exist.")
+        os.sys.exit(1)
+
+    scene_file_reader = v4r.io.SceneFileReader.create(args.dataset)
+
+    scenes = []
+    all_scenes = scene_file_reader.get_scene_ids()
+    if args.scene_id:
+        scenes = sorted(args.scene_id)
+        # check if all scene ids are present
+        diff = [x for x in scenes if x not in all_scenes]
+        if diff:
+            print("Error: The following scenes are not part of the dataset:")
+            print(diff)
+            os.sys.exit(1)
+    else:
+        scenes = all_scenes
+
+    print("Fusing point clouds")
+    for scene_id in scenes:
+        print(f"Processing scene: {scene_id}")
+        path = None
+        if args.align:
+            path = os.path.join(scene_file_reader.reconstruction_dir,
+                                scene_id,
+                                scene_file_reader.reconstruction_align_file)
+        path = scene_file_reader.write_fused_pointcloud(scene_id,
+                                                        path=path,
+                                                        voxel_size=args.voxel_size,
+                                                        stride=args.stride,
+                                                        max_depth=args.max_depth)
+        print(f"Saved {path}")
+    print("Finished")
@@ -1,6 +1,12 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import configparser
+import contextlib
+import multiprocessing
 import os
+import sys
+import time
+import traceback
 import v4r_dataset_toolkit as v4r
 import yaml
 
@@ -15,7 +21,13 @@ CONFIG = {
     "sdf_trunc": 0.018,
     "triangles": 1000000,
     "simplify": False,
-    "cluster": False
+    "cluster": False,
+    "streaming": True,
+    "prefetch_frames": 4,
+    "refine_jobs": None,
+    "seed": 0,
+    "align_sampler": "voxel",
+    "align_voxel_size": 0.003
 }
 
 
@@ -25,6 +37,149 @@ def load_config(file):
     return none
 
 
+@contextlib.contextmanager
+def redirect_output(log_file):
+    # redirects the file descriptors, so output of open3d ends up in the log too
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    with open(log_file, 'w') as fp:
+        os.dup2(fp.fileno(), 1)
+        os.dup2(fp.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+
+
+def reconstruct_scene(dataset, scene_id, config, force=False):
+    scene_file_reader = v4r.io.SceneFileReader.create(dataset)
+    path_groundtruth = scene_file_reader.get_camera_poses_path(
+        scene_id)
+    path_dataset = os.path.join(
+        scene_file_reader.reconstruction_dir,
+        scene_id)
+
+    frames = scene_file_reader.get_frames_rgbd(scene_id)
+    intrinsic = scene_file_reader.get_camera_info_scene(scene_id).as_o3d()
+    poses = scene_file_reader.get_camera_trajectory(scene_id)
+
+    reconstructor = v4r.reconstructor.Reconstructor(config=config,
+                                                    frames=frames,
+                                                    intrinsic=intrinsic,
+                                                    poses=poses,
+                                                    path_groundtruth=path_groundtruth,
+                                                    path_dataset=path_dataset)
+
+    # stages are skipped if the manifest matches their inputs and settings
+    stages = reconstructor.run(
+        manifest=scene_file_reader.get_reconstruction_manifest(scene_id),
+        input_files=scene_file_reader.get_reconstruction_inputs(scene_id),
+        force=force)
+    if not stages:
+        print(f"Scene {scene_id} is up to date.")
+        return None
+    return reconstructor.profiler.report()
+
+
+def run_scene(dataset, scene_id, config, log_file=None, force=False):
+    # returns (error or None, seconds, profile or None), failures do not stop other scenes
+    start = time.time()
+    if log_file:
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        output = redirect_output(log_file)
+    else:
+        output = contextlib.nullcontext()
+
+    with output:
+        try:
+            print(f"Processing scene: {scene_id}")
+            report = reconstruct_scene(dataset, scene_id, config, force)
+            error = None
+        except Exception as e:
+            traceback.print_exc()
+            error = f"{type(e).__name__}: {e}"
+            report = None
+    return error, time.time() - start, report
+
+
+def run_parallel(dataset, scenes, config, jobs, memory_budget, estimates, log_files, force=False):
+    # scenes are admitted in order while their estimated memory fits the budget,
+    # a single scene is always admitted so oversized scenes still run
+    results = {}
+    pending = list(scenes)
+    running = {}
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor:
+        while pending or running:
+            while pending and len(running) < jobs:
+                scene_id = pending[0]
+                used = sum(estimates[x] for x in running.values())
+                if running and memory_budget and used + estimates[scene_id] > memory_budget:
+                    break
+                pending.pop(0)
+                future = executor.submit(run_scene, dataset, scene_id, config,
+                                         log_files[scene_id], force)
+                running[future] = scene_id
+                print(f"Started scene: {scene_id}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                scene_id = running.pop(future)
+                try:
+                    results[scene_id] = future.result()
+                except Exception as e:
+                    # the worker process died
+                    results[scene_id] = (f"{type(e).__name__}: {e}", 0.0, None)
+                status = "failed" if results[scene_id][0] else "done"
+                print(f"Finished scene: {scene_id} ({status})")
+    return results
+
+
+def print_summary(scenes, results, log_files):
+    print("Summary:")
+    for scene_id in scenes:
+        error, seconds, _ = results[scene_id]
+        line = f"\t {scene_id} : {'failed' if error else 'ok'} {seconds:.1f}s"
+        if log_files[scene_id]:
+            line += f" log: {log_files[scene_id]}"
+        print(line)
+        if error:
+            print(f"\t\t {error}")
+    failed = [x for x in scenes if results[x][0]]
+    print(f"{len(scenes) - len(failed)} of {len(scenes)} scenes reconstructed.")
+    print_profiles(scenes, results)
+    return failed
+
+
+def print_profiles(scenes, results):
+    # wall seconds per stage and peak memory of every reconstructed scene
+    reports = {x: results[x][2] for x in scenes if results[x][2]}
+    if not reports:
+        return
+    stages = []
+    for report in reports.values():
+        stages += [x for x in report["stages"] if x not in stages]
+
+    width = max(10, *[len(x) + 2 for x in stages])
+    print("Stage times [s]:")
+    print(f"{'scene':<12}" + "".join(f"{x:>{width}}" for x in stages) + f"{'peak [MB]':>{width}}")
+    totals = dict.fromkeys(stages, 0.0)
+    for scene_id, report in reports.items():
+        line = f"{scene_id:<12}"
+        for stage in stages:
+            wall = report["stages"].get(stage, {}).get("wall")
+            totals[stage] += wall or 0.0
+            line += f"{wall:>{width}.2f}" if wall is not None else f"{'-':>{width}}"
+        print(line + f"{(report['peak_rss'] or 0) / 1024**2:>{width}.1f}")
+    print(f"{'total':<12}" + "".join(f"{totals[x]:>{width}.2f}" for x in stages))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         "Integrate the whole RGBD sequence using estimated camera pose.")
@@ -36,6 +191,8 @@ if __name__ == "__main__":
                         help="Target triangles for simpilfication.")
     parser.add_argument("--icp_method", type=str, default="color",
                         help="Icp-method one of ['point_to_point','robust_icp','point_to_plane','color'].")
+    parser.add_argument("--refine_jobs", type=int, default=None,
+                        help="Processes registering frame pairs during ICP refinement (default: number of cores up to 4, divided by --jobs).")
     parser.add_argument("--simplify", action="store_true",
                         help="Do simplify reconstruction.")
     parser.add_argument("--cluster", action="store_true",
@@ -52,6 +209,26 @@ if __name__ == "__main__":
                         help="Truncation value for signed distance function.")
     parser.add_argument("--scene_id", nargs='*', type=str, default=None,
                         help="Scene identifier.")
+    parser.add_argument("--roi", nargs='+', type=str, default=None,
+                        help="Integrate only depth inside a region of interest, 'auto' or xmin ymin zmin xmax ymax zmax in meter.")
+    parser.add_argument("--keyframes", action="store_true",
+                        help="Process only keyframes selected by camera motion.")
+    parser.add_argument("--keyframe_sharpness", action="store_true",
+                        help="Pick the sharpest image of each keyframe interval.")
+    parser.add_argument("--checkpoint_interval", type=int, default=None,
+                        help="Checkpoint the integration every n frames, resumes from and appends to an existing checkpoint.")
+    parser.add_argument("--align_sampler", type=str, default=None,
+                        help="Sampler for the alignment cloud one of ['voxel','area','poisson'].")
+    parser.add_argument("--force", action="store_true",
+                        help="Reconstruct even if inputs and settings are unchanged.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of scenes reconstructed in parallel processes.")
+    parser.add_argument("--memory_budget", type=float, default=None,
+                        help="Memory in GB shared by parallel reconstructions.")
+    parser.add_argument("--scene_memory", type=float, default=None,
+                        help="Memory in GB per scene, overrides the estimate.")
+    parser.add_argument("--log_dir", type=str, default=None,
+                        help="Folder for per scene log files (default: reconstruction folder of the scene when running in parallel).")
     args = parser.parse_args()
 
     config = None
@@ -75,6 +252,12 @@ if __name__ == "__main__":
         config["icp_refinement"] = True
         config["icp_method"] = args.icp_method
 
+    if args.refine_jobs:
+        config["refine_jobs"] = args.refine_jobs
+    elif args.jobs > 1 and not config.get("refine_jobs"):
+        # parallel scenes share the cores
+        config["refine_jobs"] = max(1, v4r.icp.PairwiseRefiner.jobs_for(config) // args.jobs)
+
     if args.simplify:
         config["simplify"] = True
 
@@ -96,6 +279,29 @@ if __name__ == "__main__":
     if args.sdf_trunc:
         config["sdf_trunc"] = args.sdf_trunc
 
+    if args.roi:
+        if args.roi == ["auto"]:
+            config["roi"] = "auto"
+        elif len(args.roi) == 6:
+            values = [float(x) for x in args.roi]
+            config["roi"] = [values[:3], values[3:]]
+        else:
+            print("Error: --roi expects 'auto' or six values.")
+            os.sys.exit(1)
+
+    if args.keyframes:
+        config["keyframes"] = True
+
+    if args.keyframe_sharpness:
+        config["keyframes"] = True
+        config["keyframe_sharpness"] = True
+
+    if args.checkpoint_interval is not None:
+        config["checkpoint_interval"] = args.checkpoint_interval
+
+    if args.align_sampler:
+        config["align_sampler"] = args.align_sampler
+
     print("Configuration:")
     for k, v in config.items():
         print("\t", k, ":", v)
@@ -116,27 +322,36 @@ if __name__ == "__main__":
     else:
         scenes = all_scenes
 
-    print("Creating Reconstruction")
+    log_files = {}
     for scene_id in scenes:
-        print(f"Processing scene: {scene_id}")
-        path_groundtruth = scene_file_reader.get_camera_info_scene_path(
-            scene_id)
-        path_dataset = os.path.join(
-            scene_file_reader.reconstruction_dir,
-            scene_id)
-
-        color_files = scene_file_reader.get_images_rgb(scene_id)
-        depth_files = scene_file_reader.get_images_depth(scene_id)
-        intrinsic = scene_file_reader.get_camera_info_scene(scene_id).as_o3d()
-        poses = scene_file_reader.get_camera_poses(scene_id)
-
-        reconstructor = v4r.reconstructor.Reconstructor(config=config,
-                                                        color_files=color_files,
-                                                        depth_files=depth_files,
-                                                        intrinsic=intrinsic,
-                                                        poses=poses,
-                                                        path_groundtruth=path_groundtruth,
-                                                        path_dataset=path_dataset)
-
-        reconstructor.create_reconstruction()
+        if args.log_dir:
+            log_files[scene_id] = os.path.join(args.log_dir, f"{scene_id}.log")
+        elif args.jobs > 1:
+            log_files[scene_id] = os.path.join(
+                scene_file_reader.reconstruction_dir, scene_id, "reconstruction.log")
+        else:
+            log_files[scene_id] = None
+
+    print("Creating Reconstruction")
+    if args.jobs > 1 and len(scenes) > 1:
+        estimates = {}
+        for scene_id in scenes:
+            if args.scene_memory:
+                estimates[scene_id] = args.scene_memory * 1024**3
+            else:
+                estimates[scene_id] = v4r.reconstructor.estimate_memory(
+                    scene_file_reader.get_camera_info_scene(scene_id), config,
+                    scene_file_reader.frame_cache_size)
+        memory_budget = args.memory_budget * 1024**3 if args.memory_budget else None
+        results = run_parallel(args.dataset, scenes, config, args.jobs,
+                               memory_budget, estimates, log_files, args.force)
+    else:
+        results = {}
+        for scene_id in scenes:
+            results[scene_id] = run_scene(
+                args.dataset, scene_id, config, log_files[scene_id], args.force)
+
+    failed = print_summary(scenes, results, log_files)
     print("Finished")
+    if failed:
+        os.sys.exit(1)
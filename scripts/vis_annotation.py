@@ -6,13 +6,16 @@ import open3d as o3d
 import v4r_dataset_toolkit as v4r
 
 
-def load_object_models(scene_file_reader, id):
+def load_object_models(scene_file_reader, id, lod=None):
     oriented_models = []
     # Load poses
     objects = scene_file_reader.get_object_poses(id)
     for object in tqdm(objects, desc="Loading objects."):
-        scene_object = scene_file_reader.object_library[object[0].id]
-        model = scene_object.mesh.as_trimesh()
+        if lod is None:
+            model = scene_file_reader.object_library.get_trimesh(object[0].id)
+        else:
+            model = scene_file_reader.object_library.get_object_data(
+                object[0].id).lod_trimesh(lod)
         model.apply_transform(np.array(object[1]).reshape(4, 4))
         oriented_models.append(model)
     return oriented_models
@@ -47,15 +50,31 @@ if __name__ == "__main__":
                         help="Path to dataset configuration.")
     parser.add_argument("-s", "--scene_id", type=str, required=True,
                         help="Scene identifier to visualize.")
+    parser.add_argument("-f", "--fused", action="store_true",
+                        help="Show the fused scene cloud instead of per view clouds.")
+    parser.add_argument("--voxel_size", type=float, default=0.004,
+                        help="Voxel size in meter for the fused cloud.")
+    parser.add_argument("--lod", type=int, default=None,
+                        help="Use precomputed object LOD meshes (0 is the finest).")
     args = parser.parse_args()
 
     scene_file_reader = v4r.io.SceneFileReader.create(args.dataset)
 
-    oriented_models = load_object_models(scene_file_reader, args.scene_id)
+    oriented_models = load_object_models(
+        scene_file_reader, args.scene_id, args.lod)
 
-    camera_poses = scene_file_reader.get_camera_poses(args.scene_id)
-    pointclouds = scene_file_reader.get_pointclouds(args.scene_id)
-    for i, camera_pose in enumerate(camera_poses):
-        visualize_objects(oriented_models=oriented_models,
-                          pointcloud=pointclouds[i],
-                          camera_pose=camera_pose.tf)
+    _, camera_poses = scene_file_reader.get_camera_poses_array(args.scene_id)
+    if args.fused:
+        fused = scene_file_reader.get_fused_pointcloud(
+            args.scene_id, voxel_size=args.voxel_size)
+        for camera_pose in camera_poses:
+            visualize_objects(oriented_models=oriented_models,
+                              pointcloud=fused,
+                              camera_pose=camera_pose)
+    else:
+        pointclouds = scene_file_reader.iter_pointcloud_arrays(args.scene_id)
+        for camera_pose, (points, colors) in zip(camera_poses, pointclouds):
+            visualize_objects(oriented_models=oriented_models,
+                              pointcloud=v4r.backprojection.as_o3d_pointcloud(
+                                  points, colors),
+                              camera_pose=camera_pose)
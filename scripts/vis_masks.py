@@ -102,13 +102,16 @@ def put_text(text, img, x, y, color):
                       cv2.FONT_HERSHEY_SIMPLEX, 1, [255, 255, 255], 1)
 
 
-def load_object_models(scene_file_reader):
+def load_object_models(scene_file_reader, lod=None):
     oriented_models = []
     # Load poses
     objects = scene_file_reader.get_object_poses(args.scene_id)
     for object in tqdm(objects, desc="Loading objects"):
-        scene_object = scene_file_reader.object_library[object[0].id]
-        model = scene_object.mesh.as_trimesh()
+        if lod is None:
+            model = scene_file_reader.object_library.get_trimesh(object[0].id)
+        else:
+            model = scene_file_reader.object_library.get_object_data(
+                object[0].id).lod_trimesh(lod)
         model.apply_transform(np.array(object[1]).reshape(4, 4))
         oriented_models.append(model)
     return oriented_models
@@ -131,6 +134,8 @@ if __name__ == "__main__":
                         help="Visualize scene and optionally save to file.")
     parser.add_argument("-r", "--rotate", action='store_true', default='',
                         help="Rotate image.")
+    parser.add_argument("--lod", type=int, default=None,
+                        help="Use precomputed object LOD meshes (0 is the finest).")
     args = parser.parse_args()
 
     if args.output:
@@ -144,10 +149,10 @@ if __name__ == "__main__":
         sys.exit(1)
 
     scene_file_reader = v4r.io.SceneFileReader.create(args.dataset)
-    camera_poses = scene_file_reader.get_camera_poses(args.scene_id)
+    _, camera_poses = scene_file_reader.get_camera_poses_array(args.scene_id)
     intrinsic = scene_file_reader.get_camera_info_scene(args.scene_id)
     objects = scene_file_reader.get_object_poses(args.scene_id)
-    oriented_models = load_object_models(scene_file_reader)
+    oriented_models = load_object_models(scene_file_reader, args.lod)
 
     model_colors = []
     if args.visualize:
@@ -161,8 +166,7 @@ if __name__ == "__main__":
             i += 1
             model_colors.append([i, 0, 0])
 
-    orig_imgs = scene_file_reader.get_images_rgb(args.scene_id)
-    camera_poses = [pose.tf for pose in camera_poses]
+    orig_imgs = scene_file_reader.get_frames_rgb(args.scene_id)
     annotation_imgs = project_mesh_to_2d(
         oriented_models, camera_poses, model_colors, intrinsic)
 
@@ -7,6 +7,7 @@ python_versions = '>=3.6'  # restricted by availability of pyrender
 
 requirements_default = [
     'numpy',
+    'scipy',
     'open3d',
     'trimesh[easy]',
     'pyyaml',
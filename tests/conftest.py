@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+import trimesh
+from PIL import Image
+
+
+@pytest.fixture
+def textured_object(tmp_path):
+    # path of a box exported as obj with a texture, which open3d reads with uvs
+    path = str(tmp_path / 'box.obj')
+    mesh = trimesh.creation.box()
+    texture = Image.new('RGB', (4, 4), (255, 0, 0))
+    uv = np.random.default_rng(0).random((len(mesh.vertices), 2))
+    mesh.visual = trimesh.visual.TextureVisuals(
+        uv=uv, material=trimesh.visual.material.SimpleMaterial(image=texture))
+    mesh.export(path)
+    return path
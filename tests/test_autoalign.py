@@ -0,0 +1,36 @@
+import numpy as np
+import open3d as o3d
+
+from v4r_dataset_toolkit import autoalign
+
+
+def box_scene():
+    o3d.utility.random.seed(0)
+    box = o3d.geometry.TriangleMesh.create_box(0.1, 0.06, 0.04)
+    source = box.sample_points_uniformly(3000)
+    table = o3d.geometry.TriangleMesh.create_box(0.5, 0.5, 0.01).translate([-0.2, -0.2, -0.01])
+    scene = table.sample_points_uniformly(20000) + box.sample_points_uniformly(5000)
+    return source, scene
+
+
+def test_align_hypotheses_refines_top_k(monkeypatch):
+    source, scene = box_scene()
+    refined = []
+    refine_alignment = autoalign.refine_alignment
+
+    def counting_refine(source_pcd, target_pcd, init_pose):
+        refined.append(init_pose)
+        return refine_alignment(source_pcd, target_pcd, init_pose)
+
+    monkeypatch.setattr(autoalign, 'refine_alignment', counting_refine)
+    center, _ = autoalign.bounding_sphere(source)
+    pose = np.identity(4)
+    pose[:3, 3] = [0.01, -0.005, 0.0]
+    hypotheses = autoalign.pose_hypotheses(pose, center, count=8)
+
+    results = autoalign.align_hypotheses(None, scene, hypotheses, source_pcd=source, top_k=3)
+    assert len(refined) == 3
+    assert len(results) == 3
+    assert 0 in [x['hypothesis'] for x in results]
+    fitness = [x['fitness'] for x in results]
+    assert fitness == sorted(fitness, reverse=True)
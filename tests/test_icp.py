@@ -0,0 +1,43 @@
+import numpy as np
+
+from v4r_dataset_toolkit import icp
+
+
+def translation(x):
+    transform = np.identity(4)
+    transform[0, 3] = x
+    return transform
+
+
+def test_rejected_pair_counts_as_identity(monkeypatch):
+    # pair 2 diverged, it must not move frame 2 or any later frame
+    pairs = iter([(translation(0.01), {'fitness': 0.9, 'rmse': 0.001, 'motion': 0.01}),
+                  (translation(0.5), {'fitness': 0.1, 'rmse': 0.001, 'motion': 0.5}),
+                  (translation(0.01), {'fitness': 0.9, 'rmse': 0.001, 'motion': 0.01})])
+    monkeypatch.setattr(icp, 'frame_cloud', lambda rgbd, intrinsic, pose: 'cloud')
+    monkeypatch.setattr(icp, 'register_clouds', lambda source, target, config: next(pairs))
+
+    refiner = icp.PairwiseRefiner(None, {'voxel_size': 0.004})
+    for frame_id in range(4):
+        refiner.add(None, np.identity(4), frame_id)
+    poses = [pose for pose, _ in refiner.results()]
+
+    assert refiner.rejected == [2]
+    assert [pose[0, 3] for pose in poses] == [0.0, 0.01, 0.01, 0.02]
+
+
+def test_default_jobs_are_bounded(monkeypatch):
+    monkeypatch.setattr(icp.os, 'cpu_count', lambda: 64)
+    assert icp.PairwiseRefiner.jobs_for({}) == icp.PairwiseRefiner.MAX_JOBS
+    assert icp.PairwiseRefiner.jobs_for({'refine_jobs': 8}) == 8
+
+
+def test_memory_estimate_counts_refinement_workers():
+    from v4r_dataset_toolkit.io import CameraInfo
+    from v4r_dataset_toolkit.reconstructor import REFINE_WORKER_BYTES, estimate_memory
+
+    camera_info = CameraInfo(width=640, height=480, fx=500, fy=500, cx=320, cy=240)
+    config = {'tsdf_cubic_size': 1.5, 'sdf_trunc': 0.01, 'icp_refinement': True}
+    one = estimate_memory(camera_info, dict(config, refine_jobs=1))
+    four = estimate_memory(camera_info, dict(config, refine_jobs=4))
+    assert four - one > 4 * REFINE_WORKER_BYTES
@@ -0,0 +1,42 @@
+import os
+
+from v4r_dataset_toolkit.index import DatasetIndex
+
+
+def create_index(root, camera_intrinsics_file=None, camera_pose_file=None):
+    os.makedirs(os.path.join(root, 'scenes', '001', 'rgb'))
+    os.makedirs(os.path.join(root, 'scenes', '001', 'depth'))
+    open(os.path.join(root, 'scenes', '001', 'rgb', '000000.png'), 'w').close()
+    return DatasetIndex(os.path.join(root, 'index.json'), os.path.join(root, 'scenes'),
+                        'rgb', 'depth', camera_intrinsics_file, camera_pose_file,
+                        os.path.join(root, 'annotations'), None)
+
+
+def test_unconfigured_files(tmp_path):
+    index = create_index(str(tmp_path))
+    assert index.frames('001', 'rgb')[0].endswith('000000.png')
+    assert index.intrinsics('001') is None
+    assert index.pose_file('001') is None
+    assert not index.has_annotation('001')
+
+
+def test_read_only_warns_once(tmp_path, recwarn):
+    index = create_index(str(tmp_path))
+    index.path = str(tmp_path / 'missing' / 'index.json')
+    index.frames('001', 'rgb')
+    index.validated.clear()
+    index.dirty = True
+    index.frames('001', 'rgb')
+    assert len([x for x in recwarn if 'dataset index' in str(x.message)]) == 1
+
+
+
+def test_save_ignores_other_writers_tmp(tmp_path):
+    # another worker's temporary file must not make the index read-only
+    index = create_index(str(tmp_path))
+    (tmp_path / 'index.json.tmp').mkdir()
+    index.frames('001', 'rgb')
+    index.dirty = True
+    index.save()
+    assert not index.read_only
+    assert sorted(os.listdir(str(tmp_path))) == ['index.json', 'index.json.tmp', 'scenes']
@@ -0,0 +1,38 @@
+import open3d as o3d
+
+from v4r_dataset_toolkit.meshreader import MeshReader
+
+
+def count_parses(monkeypatch):
+    calls = []
+    read = o3d.io.read_triangle_mesh
+
+    def counting_read(*args, **kwargs):
+        calls.append(args)
+        return read(*args, **kwargs)
+
+    monkeypatch.setattr(o3d.io, 'read_triangle_mesh', counting_read)
+    return calls
+
+
+def test_uncacheable_mesh_parsed_once_per_call(tmp_path, monkeypatch, textured_object):
+    calls = count_parses(monkeypatch)
+
+    reader = MeshReader(textured_object, cache_dir=str(tmp_path / 'cache'))
+    assert reader.as_o3d().has_triangle_uvs()
+    assert reader.as_o3d().has_triangle_uvs()
+    assert len(calls) == 2
+    assert reader.load_arrays() is None
+    assert len(calls) == 2
+
+
+def test_cached_mesh_parsed_once(tmp_path, monkeypatch):
+    path = str(tmp_path / 'sphere.ply')
+    o3d.io.write_triangle_mesh(path, o3d.geometry.TriangleMesh.create_sphere())
+    calls = count_parses(monkeypatch)
+
+    reader = MeshReader(path, cache_dir=str(tmp_path / 'cache'))
+    reader.as_o3d()
+    reader.as_o3d()
+    reader.as_trimesh()
+    assert len(calls) == 1
@@ -0,0 +1,19 @@
+import trimesh
+
+from v4r_dataset_toolkit.objects import ObjectLibrary, geometry_nbytes
+
+
+def test_geometry_nbytes_textured(textured_object):
+    mesh = trimesh.load_mesh(textured_object)
+    assert mesh.visual.kind == 'texture'
+    assert geometry_nbytes(mesh) >= mesh.vertices.nbytes + mesh.faces.nbytes
+
+
+def test_get_trimesh_textured(tmp_path, textured_object):
+    library_file = tmp_path / 'objects.yaml'
+    library_file.write_text("- id: box\n  mesh: box.obj\n")
+    library = ObjectLibrary.create(str(library_file))
+
+    mesh = library.get_trimesh('box')
+    assert len(mesh.faces) == 12
+    assert library.geometry_stats()['entries'] == 1
@@ -0,0 +1,80 @@
+import numpy as np
+import open3d as o3d
+
+from v4r_dataset_toolkit import icp
+from v4r_dataset_toolkit.io import CameraTrajectory, read_camera_poses
+from v4r_dataset_toolkit.reconstructor import Reconstructor
+
+
+def create_frames(count, seed=0):
+    # a slanted plane seen from noisy camera poses
+    rng = np.random.default_rng(seed)
+    rows, cols = np.mgrid[:48, :64]
+    depth = (800 + 4 * rows + 2 * cols).astype(np.uint16)
+    color = rng.integers(0, 255, (48, 64, 3), dtype=np.uint8)
+    frames = [(o3d.geometry.Image(color), o3d.geometry.Image(depth)) for _ in range(count)]
+    poses = np.tile(np.identity(4), (count, 1, 1))
+    poses[:, :3, 3] = rng.normal(scale=0.003, size=(count, 3))
+    return frames, poses
+
+
+def register_centroids(source, target, config):
+    # moves the target centroid onto the source centroid
+    transfo = np.identity(4)
+    transfo[:3, 3] = np.mean(source[0], axis=0) - np.mean(target[0], axis=0)
+    return transfo, {'fitness': 1.0, 'rmse': 0.0, 'motion': float(np.linalg.norm(transfo[:3, 3]))}
+
+
+def refine(path, frames, poses):
+    config = {'max_depth': 3.0, 'tsdf_cubic_size': 5.12, 'sdf_trunc': 0.04,
+              'voxel_size': 0.004, 'icp_refinement': True, 'refine_jobs': 1,
+              'save_refined': True, 'checkpoint_interval': 5}
+    groundtruth = str(path / 'groundtruth.txt')
+    reconstructor = Reconstructor(config, poses=CameraTrajectory.from_matrices(poses),
+                                  intrinsic=o3d.camera.PinholeCameraIntrinsic(
+                                      64, 48, 50.0, 50.0, 32.0, 24.0),
+                                  path_groundtruth=groundtruth,
+                                  path_dataset=str(path), frames=frames)
+    reconstructor.integrate()
+    return read_camera_poses(groundtruth[:-4] + '_refined.txt')[1]
+
+
+def test_resumed_refinement_matches_full_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(icp, 'register_clouds', register_centroids)
+    frames, poses = create_frames(30)
+    (tmp_path / 'full').mkdir()
+    (tmp_path / 'resumed').mkdir()
+
+    full = refine(tmp_path / 'full', frames, poses)
+    refine(tmp_path / 'resumed', frames[:20], poses[:20])
+    resumed = refine(tmp_path / 'resumed', frames, poses)
+
+    np.testing.assert_allclose(resumed, full, atol=1e-9)
+
+
+def reconstruct(path, frames, poses, checkpoint_interval):
+    config = {'max_depth': 3.0, 'tsdf_cubic_size': 5.12, 'sdf_trunc': 0.04,
+              'checkpoint_interval': checkpoint_interval}
+    reconstructor = Reconstructor(config, poses=CameraTrajectory.from_matrices(poses),
+                                  intrinsic=o3d.camera.PinholeCameraIntrinsic(
+                                      64, 48, 50.0, 50.0, 32.0, 24.0),
+                                  path_groundtruth=str(path / 'groundtruth.txt'),
+                                  path_dataset=str(path), frames=frames)
+    reconstructor.integrate()
+    return o3d.io.read_triangle_mesh(str(path / 'reconstruction.ply'))
+
+
+def test_checkpoint_volume_meshes_like_scalable_volume(tmp_path):
+    # the volumes differ only in how far the surface extends past the image border
+    frames, poses = create_frames(1)
+    (tmp_path / 'scalable').mkdir()
+    (tmp_path / 'checkpoint').mkdir()
+    scalable = reconstruct(tmp_path / 'scalable', frames, poses, 0)
+    checkpoint = reconstruct(tmp_path / 'checkpoint', frames, poses, 5)
+
+    assert len(checkpoint.vertices) > 0.9 * len(scalable.vertices)
+    assert checkpoint.get_surface_area() > 0.9 * scalable.get_surface_area()
+    vertices = o3d.geometry.PointCloud(checkpoint.vertices)
+    distances = np.asarray(vertices.compute_point_cloud_distance(
+        o3d.geometry.PointCloud(scalable.vertices)))
+    assert distances.max() < 0.01
@@ -1,5 +1,18 @@
 from . import io
+from . import cache
+from . import frames
+from . import index
+from . import backprojection
+from . import fusion
+from . import profiling
+from . import volume
+from . import keyframes
+from . import sampling
+from . import features
+from . import voxelindex
+from . import manifest
 from . import objects
+from . import objectdata
 from . import meshreader
 from . import reconstructor
 from . import icp
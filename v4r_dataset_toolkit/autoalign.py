@@ -1,9 +1,15 @@
 import numpy as np
 import open3d as o3d
 from tqdm import tqdm
-from v4r_dataset_toolkit.icp import multiscale_icp
+from v4r_dataset_toolkit.cache import LRUCache
+from v4r_dataset_toolkit.features import FEATURE_VOXEL_SIZE, compute_features, global_registration
+from v4r_dataset_toolkit.icp import multiscale_icp, PointCloudPyramid
+from v4r_dataset_toolkit.sampling import sample_pointcloud
 import copy
 
+# pyramids of the recently aligned scene clouds, keyed by the cloud object
+SCENE_PYRAMIDS = LRUCache(maxsize=2)
+
 
 def draw_registration_result_original_color(source, target, transformation):
     source_temp = copy.deepcopy(source)
@@ -12,18 +18,53 @@ def draw_registration_result_original_color(source, target, transformation):
     o3d.visualization.draw_geometries([source_temp, target_temp])
 
 
-def sample_pointcloud(mesh, uniform_points=4500, poisson_points=4500):
-    pcd = mesh.sample_points_uniformly(number_of_points=uniform_points)
-    pcd = mesh.sample_points_poisson_disk(
-        number_of_points=poisson_points, pcl=pcd)
-    return pcd
-
-
-def auto_align(object_mesh, scene_mesh, init_pose=np.identity(4)):
-
-    source_pcd = sample_pointcloud(object_mesh, 10000, 10000)
-    target_pcd = scene_mesh
-
+def scene_pyramid(scene_pcd):
+    # the same scene cloud gets the same pyramid, so aligning further objects
+    # only downsamples the object samples
+    if isinstance(scene_pcd, PointCloudPyramid):
+        return scene_pcd
+    # the entry holds the cloud, so its id is not reused while cached
+    entry = SCENE_PYRAMIDS.get(id(scene_pcd))
+    if entry is None or entry[0] is not scene_pcd:
+        entry = (scene_pcd, PointCloudPyramid(scene_pcd))
+        SCENE_PYRAMIDS.put(id(scene_pcd), entry)
+    return entry[1]
+
+
+def bounding_sphere(pcd):
+    points = np.asarray(pcd.points)
+    center = (points.min(axis=0) + points.max(axis=0)) / 2
+    return center, float(np.linalg.norm(points - center, axis=1).max())
+
+
+def crop_scene(scene_pyramid, pose, sphere, margin):
+    # scene points around the object's bounding sphere placed at pose
+    pose = np.asarray(pose, dtype=float)
+    center, radius = sphere
+    scale = np.linalg.norm(pose[:3, :3], axis=0).max()
+    return scene_pyramid.crop(pose[:3, :3] @ np.asarray(center) + pose[:3, 3],
+                              radius * scale + margin)
+
+
+def prepare_alignment(object_mesh, scene_mesh, init_pose, source_pcd, sphere, crop_margin):
+    # object and scene pyramids, the scene cropped around the object at init_pose
+    if source_pcd is None:
+        source_pcd = sample_pointcloud(object_mesh, 10000, 10000)
+    source_pcd = PointCloudPyramid(source_pcd)
+    target_pcd = scene_pyramid(scene_mesh)
+    if crop_margin is not None:
+        if sphere is None:
+            sphere = bounding_sphere(source_pcd.cloud)
+        cropped = crop_scene(target_pcd, init_pose, sphere, crop_margin)
+        # the 4 mm level is registered by both passes of refine_alignment
+        if len(cropped.level(0.004).points):
+            target_pcd = cropped
+        else:
+            print("No scene points near the object, aligning to the whole scene.")
+    return source_pcd, target_pcd
+
+
+def refine_alignment(source_pcd, target_pcd, init_pose):
     transform = init_pose
 
     point_to_plane = True
@@ -35,7 +76,7 @@ def auto_align(object_mesh, scene_mesh, init_pose=np.identity(4)):
 
         voxel_size = float(config.get("voxel_size"))
 
-        transform, information_mat = multiscale_icp(
+        transform, information_mat, _ = multiscale_icp(
             source_pcd,
             target_pcd,
             [voxel_size],
@@ -49,7 +90,7 @@ def auto_align(object_mesh, scene_mesh, init_pose=np.identity(4)):
 
         voxel_size = float(config.get("voxel_size"))
 
-        transform, information_mat = multiscale_icp(
+        transform, information_mat, _ = multiscale_icp(
             source_pcd,
             target_pcd,
             [2*voxel_size, voxel_size, voxel_size/2.0, voxel_size/4.0],
@@ -58,3 +99,124 @@ def auto_align(object_mesh, scene_mesh, init_pose=np.identity(4)):
             init_transformation=transform)
 
     return transform, information_mat
+
+
+def auto_align(object_mesh, scene_mesh, init_pose=np.identity(4), source_pcd=None,
+               sphere=None, crop_margin=0.05):
+    # source_pcd: precomputed object samples, e.g. from ObjectData.samples
+    # scene_mesh: scene point cloud or its PointCloudPyramid
+    # sphere: bounding sphere (center, radius) of the object, e.g. from
+    # ObjectData.bounding_sphere, the scene is cropped to it plus crop_margin
+    # around init_pose, None for crop_margin registers the whole scene
+    source_pcd, target_pcd = prepare_alignment(object_mesh, scene_mesh, init_pose,
+                                               source_pcd, sphere, crop_margin)
+    return refine_alignment(source_pcd, target_pcd, init_pose)
+
+
+def global_align(object_mesh, scene_mesh, source_pcd=None, source_features=None,
+                 target_features=None, method='ransac', voxel_size=FEATURE_VOXEL_SIZE,
+                 sphere=None, crop_margin=0.05):
+    # coarse pose from FPFH feature matching, refined like auto_align, returns
+    # (transform, information, coarse result)
+    # source_features, target_features: (cloud, features) of object and scene,
+    # e.g. from ObjectData.features and SceneFileReader.get_reconstruction_align_features,
+    # missing ones are computed for this call only
+    if source_pcd is None:
+        source_pcd = sample_pointcloud(object_mesh, 10000, 10000)
+    if source_features is None:
+        source_features = compute_features(source_pcd, voxel_size)
+    if target_features is None:
+        target_features = compute_features(
+            scene_mesh.cloud if isinstance(scene_mesh, PointCloudPyramid) else scene_mesh,
+            voxel_size)
+
+    coarse = global_registration(source_features, target_features, voxel_size, method)
+    transform, information = auto_align(object_mesh, scene_mesh, init_pose=coarse.transformation,
+                                        source_pcd=source_pcd, sphere=sphere,
+                                        crop_margin=crop_margin)
+    return transform, information, coarse
+
+
+def rotation_about(center, rotation):
+    # 4x4 rotation about center
+    transform = np.identity(4)
+    transform[:3, :3] = rotation
+    transform[:3, 3] = center - rotation @ center
+    return transform
+
+
+def pose_hypotheses(pose, center=np.zeros(3), count=16, translation=0.01, rotation=10.0,
+                    flips=True, seed=0):
+    # the pose, its 180 degree flips about the object axes through center and
+    # count random perturbations of up to translation meter and rotation degree
+    pose = np.asarray(pose, dtype=float)
+    center = np.asarray(center, dtype=float)
+    poses = [pose]
+    if flips:
+        for axis in np.identity(3):
+            flip = o3d.geometry.get_rotation_matrix_from_axis_angle(axis * np.pi)
+            poses.append(pose @ rotation_about(center, flip))
+
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        axis = rng.normal(size=3)
+        angle = np.radians(rotation) * rng.uniform(-1, 1)
+        perturbation = rotation_about(center, o3d.geometry.get_rotation_matrix_from_axis_angle(
+            axis / np.linalg.norm(axis) * angle))
+        perturbation[:3, 3] += rng.uniform(-translation, translation, 3)
+        poses.append(pose @ perturbation)
+    return np.stack(poses)
+
+
+def score_poses(poses, points, kdtree, max_distance):
+    # fitness (inlier fraction) and inlier rmse of points moved by every pose,
+    # all poses are scored with one nearest neighbour query
+    moved = np.einsum('nij,mj->nmi', poses[:, :3, :3], points) + poses[:, None, :3, 3]
+    distances, _ = kdtree.query(moved.reshape(-1, 3), distance_upper_bound=max_distance)
+    distances = distances.reshape(len(poses), len(points))
+    inliers = np.isfinite(distances)
+    count = inliers.sum(axis=1)
+    squared = np.where(inliers, distances, 0.0)**2
+    fitness = count / len(points)
+    rmse = np.sqrt(squared.sum(axis=1) / np.maximum(count, 1))
+    return fitness, rmse
+
+
+def align_hypotheses(object_mesh, scene_mesh, init_poses, source_pcd=None, sphere=None,
+                     crop_margin=0.05, top_k=3, score_voxel_size=0.008, max_distance=0.01):
+    # scores all init_poses on coarse levels and refines top_k poses with ICP,
+    # the first pose and the top_k - 1 best scored others, returns them ranked
+    # by fitness, then rmse, as dicts with pose, fitness, rmse, information
+    # and the index of the hypothesis
+    init_poses = np.asarray(init_poses, dtype=float).reshape(-1, 4, 4)
+    if source_pcd is None:
+        source_pcd = sample_pointcloud(object_mesh, 10000, 10000)
+    if sphere is None:
+        sphere = bounding_sphere(source_pcd)
+    if crop_margin is not None:
+        # the crop around the first pose covers the moved centers of all poses
+        centers = init_poses[:, :3, :3] @ np.asarray(sphere[0]) + init_poses[:, :3, 3]
+        crop_margin += np.linalg.norm(centers - centers[0], axis=1).max()
+    source_pcd, target_pcd = prepare_alignment(object_mesh, scene_mesh, init_poses[0],
+                                               source_pcd, sphere, crop_margin)
+
+    fitness, rmse = score_poses(init_poses,
+                                np.asarray(source_pcd.level(score_voxel_size).points),
+                                target_pcd.kdtree(score_voxel_size), max_distance)
+    order = np.lexsort((rmse, -fitness))
+    selected = [0] + [int(x) for x in order if x != 0][:max(top_k - 1, 0)]
+
+    results = []
+    for index in selected:
+        pose, information = refine_alignment(source_pcd, target_pcd, init_poses[index])
+        results.append({'pose': pose, 'information': information, 'hypothesis': index})
+
+    # final scores on the finest registered level with the icp distance
+    voxel_size = 0.004
+    fitness, rmse = score_poses(np.stack([x['pose'] for x in results]),
+                                np.asarray(source_pcd.level(voxel_size / 4.0).points),
+                                target_pcd.kdtree(voxel_size / 4.0), voxel_size * 1.4)
+    for result, f, r in zip(results, fitness, rmse):
+        result['fitness'] = float(f)
+        result['rmse'] = float(r)
+    return sorted(results, key=lambda x: (-x['fitness'], x['rmse']))
@@ -0,0 +1,141 @@
+import numpy as np
+import open3d as o3d
+
+from .cache import LRUCache
+
+RAY_GRIDS = LRUCache(8)
+
+
+def get_ray_grid(width, height, fx, fy, cx, cy, stride=1):
+    # normalized image plane coordinates of every stride-th pixel
+    key = (width, height, fx, fy, cx, cy, stride)
+    grid = RAY_GRIDS.get(key)
+    if grid is None:
+        u = (np.arange(0, width, stride) - cx) / fx
+        v = (np.arange(0, height, stride) - cy) / fy
+        x, y = np.meshgrid(u, v)
+        grid = (x, y)
+        RAY_GRIDS.put(key, grid)
+    return grid
+
+
+def voxel_keys(points, voxel_size):
+    # one int64 key per voxel, 21 bits per axis
+    cells = np.floor(points / voxel_size).astype(np.int64) + (1 << 20)
+    return (cells[:, 0] << 42) | (cells[:, 1] << 21) | cells[:, 2]
+
+
+def voxel_downsample(points, colors, voxel_size):
+    # average points and colors falling into the same voxel
+    keys, inverse, counts = np.unique(voxel_keys(points, voxel_size),
+                                      return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    points = np.stack([np.bincount(inverse, points[:, i], len(keys))
+                       for i in range(3)], axis=1) / counts[:, None]
+    if colors is not None:
+        colors = np.stack([np.bincount(inverse, colors[:, i], len(keys))
+                           for i in range(3)], axis=1) / counts[:, None]
+    return points, colors
+
+
+def as_o3d_pointcloud(points, colors=None, normals=None):
+    pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points))
+    if colors is not None:
+        pcd.colors = o3d.utility.Vector3dVector(colors)
+    if normals is not None:
+        pcd.normals = o3d.utility.Vector3dVector(normals)
+    return pcd
+
+
+def estimate_roi(backprojector, frames, poses, depth_percentile=90, percentile=2, margin=0.05):
+    # aabb of the region seen by most views, far depth of every view and
+    # outliers along each axis are ignored
+    points = []
+    for (color, depth), pose in zip(frames, poses):
+        frame_points, _ = backprojector.project(depth)
+        if not len(frame_points):
+            continue
+        frame_points = frame_points[frame_points[:, 2] <= np.percentile(
+            frame_points[:, 2], depth_percentile)]
+        pose = np.asarray(pose)
+        points.append(frame_points @ pose[:3, :3].T + pose[:3, 3])
+
+    if not points:
+        return None
+    points = np.concatenate(points)
+    return (np.percentile(points, percentile, axis=0) - margin,
+            np.percentile(points, 100 - percentile, axis=0) + margin)
+
+
+class BackProjector:
+    """ Back-projects depth images to point arrays with numpy.
+
+    The per-pixel ray grid is computed once per intrinsics and stride and
+    reused for every frame. Depth outside [min_depth, max_depth] meters is
+    discarded. Defaults match open3d's RGBDImage conversion.
+    """
+
+    def __init__(self, camera_info, stride=1, depth_scale=1000.0,
+                 min_depth=0.0, max_depth=3.0):
+        self.camera_info = camera_info
+        self.stride = max(int(stride), 1)
+        self.depth_scale = depth_scale
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.ray_x, self.ray_y = get_ray_grid(camera_info.width,
+                                              camera_info.height,
+                                              camera_info.fx,
+                                              camera_info.fy,
+                                              camera_info.cx,
+                                              camera_info.cy,
+                                              self.stride)
+
+    def project(self, depth, color=None, pose=None):
+        # returns (N,3) points and (N,3) colors in [0,1] or None
+        s = self.stride
+        z = np.asarray(depth)[::s, ::s].astype(np.float64) / self.depth_scale
+        mask = z > max(self.min_depth, 0)
+        if self.max_depth:
+            mask &= z <= self.max_depth
+
+        z = z[mask]
+        points = np.empty((len(z), 3))
+        points[:, 0] = self.ray_x[mask] * z
+        points[:, 1] = self.ray_y[mask] * z
+        points[:, 2] = z
+
+        if pose is not None:
+            pose = np.asarray(pose)
+            points = points @ pose[:3, :3].T + pose[:3, 3]
+
+        colors = None
+        if color is not None:
+            color = np.asarray(color)[::s, ::s]
+            colors = color[mask][:, :3].astype(np.float64)
+            if color.dtype == np.uint8:
+                colors /= 255.0
+            elif color.dtype == np.uint16:
+                colors /= 65535.0
+
+        return points, colors
+
+    def crop_depth(self, depth, pose, aabb):
+        # copy of depth with pixels outside the world space aabb (min, max) set to 0,
+        # the ray grid has to cover every pixel, i.e. stride 1
+        depth = np.array(depth)
+        z = depth.astype(np.float64) / self.depth_scale
+        pose = np.asarray(pose)
+        inside = z > 0
+        for i in range(3):
+            # world coordinate i of every pixel, one component at a time
+            rotation = pose[i, :3]
+            value = z * (rotation[0] * self.ray_x + rotation[1] * self.ray_y +
+                         rotation[2]) + pose[i, 3]
+            inside &= (value >= aabb[0][i]) & (value <= aabb[1][i])
+        depth[~inside] = 0
+        return depth
+
+    def project_frames(self, frames, poses):
+        # generator over (rgb, depth) frames, keeps only one frame in memory
+        for (color, depth), pose in zip(frames, poses):
+            yield self.project(depth, color, pose)
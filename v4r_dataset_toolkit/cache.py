@@ -0,0 +1,72 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    """ Bounded mapping which evicts the least recently used entry.
+
+    Bounded by the number of entries (maxsize) and optionally by memory
+    (maxbytes), where sizeof returns the size of a value in bytes.
+    """
+
+    def __init__(self, maxsize=32, maxbytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        if key in self._data:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        if self.maxsize is not None and self.maxsize <= 0:
+            return
+        self.pop(key)
+        size = self.sizeof(value) if self.sizeof else 0
+        if self.maxbytes is not None and size > self.maxbytes:
+            return
+
+        self._data[key] = value
+        self._sizes[key] = size
+        self.nbytes += size
+        while ((self.maxsize is not None and len(self._data) > self.maxsize) or
+               (self.maxbytes is not None and self.nbytes > self.maxbytes)):
+            old_key, _ = self._data.popitem(last=False)
+            self.nbytes -= self._sizes.pop(old_key)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        if key not in self._data:
+            return default
+        self.nbytes -= self._sizes.pop(key)
+        return self._data.pop(key)
+
+    def clear(self):
+        self._data.clear()
+        self._sizes.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        calls = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / calls if calls else 0.0,
+                'entries': len(self._data),
+                'nbytes': self.nbytes,
+                'maxbytes': self.maxbytes}
@@ -0,0 +1,92 @@
+import json
+import numpy as np
+import open3d as o3d
+import os
+
+FEATURE_VOXEL_SIZE = 0.01
+REGISTRATION_METHODS = ('ransac', 'fgr')
+
+
+def compute_features(pcd, voxel_size=FEATURE_VOXEL_SIZE):
+    # downsampled cloud with normals and its FPFH features
+    down = pcd.voxel_down_sample(voxel_size)
+    down.estimate_normals(
+        o3d.geometry.KDTreeSearchParamHybrid(radius=voxel_size * 2.0, max_nn=30))
+    fpfh = o3d.pipelines.registration.compute_fpfh_feature(
+        down, o3d.geometry.KDTreeSearchParamHybrid(radius=voxel_size * 5.0, max_nn=100))
+    return down, fpfh
+
+
+def file_key(path, voxel_size=FEATURE_VOXEL_SIZE):
+    # features are stale once the cloud file or the voxel size changes
+    stat = os.stat(path)
+    return {'file': os.path.basename(path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'voxel_size': voxel_size}
+
+
+def save_features(path, down, fpfh, key=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fp:
+        np.savez(fp,
+                 points=np.asarray(down.points),
+                 normals=np.asarray(down.normals),
+                 features=np.asarray(fpfh.data),
+                 key=json.dumps(key, sort_keys=True))
+    os.replace(tmp_path, path)
+
+
+def load_features(path, key=None):
+    # (cloud, features) or None if the file is missing or was built for another key
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            if json.loads(str(data['key'])) != key:
+                return None
+            down = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(data['points']))
+            down.normals = o3d.utility.Vector3dVector(data['normals'])
+            fpfh = o3d.pipelines.registration.Feature()
+            fpfh.data = data['features']
+    except (OSError, ValueError, KeyError):
+        return None
+    return down, fpfh
+
+
+def cached_features(path, key, pcd, voxel_size=FEATURE_VOXEL_SIZE):
+    # pcd is a cloud or a function returning it, only called on a cache miss
+    features = load_features(path, key)
+    if features is None:
+        down, fpfh = compute_features(pcd() if callable(pcd) else pcd, voxel_size)
+        save_features(path, down, fpfh, key)
+        features = down, fpfh
+    return features
+
+
+def global_registration(source, target, voxel_size=FEATURE_VOXEL_SIZE, method='ransac', seed=0):
+    # coarse transformation of the source onto the target, both (cloud, features)
+    source_down, source_fpfh = source
+    target_down, target_fpfh = target
+    distance = voxel_size * 1.5
+    if method == 'ransac':
+        # seeded, so a registration is reproducible
+        o3d.utility.random.seed(seed)
+        return o3d.pipelines.registration.registration_ransac_based_on_feature_matching(
+            source_down, target_down, source_fpfh, target_fpfh,
+            mutual_filter=True,
+            max_correspondence_distance=distance,
+            estimation_method=o3d.pipelines.registration.TransformationEstimationPointToPoint(False),
+            ransac_n=3,
+            checkers=[
+                o3d.pipelines.registration.CorrespondenceCheckerBasedOnEdgeLength(0.9),
+                o3d.pipelines.registration.CorrespondenceCheckerBasedOnDistance(distance)],
+            criteria=o3d.pipelines.registration.RANSACConvergenceCriteria(100000, 0.999))
+    elif method == 'fgr':
+        return o3d.pipelines.registration.registration_fgr_based_on_feature_matching(
+            source_down, target_down, source_fpfh, target_fpfh,
+            o3d.pipelines.registration.FastGlobalRegistrationOption(
+                maximum_correspondence_distance=voxel_size * 0.5))
+    raise ValueError(
+        f"Registration {method} not supported, use one of {REGISTRATION_METHODS}.")
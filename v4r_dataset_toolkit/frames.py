@@ -0,0 +1,162 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import numbers
+import open3d as o3d
+import queue
+import threading
+
+from .cache import LRUCache
+
+
+def read_image(file):
+    return o3d.io.read_image(file)
+
+
+def read_image_pair(files):
+    return tuple(read_image(file) for file in files)
+
+
+def prefetch(items, size=4):
+    """ Iterate items produced by a background thread.
+
+    At most size items are buffered, so the producer runs ahead of the
+    consumer without holding the whole sequence. Exceptions raised while
+    producing are re-raised in the consuming thread.
+    """
+    if size <= 0:
+        yield from items
+        return
+
+    buffer = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+        except BaseException as error:
+            put((done, error))
+            return
+        put((done, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # lets the producer exit if the consumer stops early
+        stop.set()
+        thread.join()
+
+
+class DecodePool:
+    """ Thread pool decoding images ahead of the consumer.
+
+    The image decoders release the GIL, so threads are sufficient to keep
+    several cores busy. Results are always returned in input order and at
+    most read_ahead decodes are in flight.
+    """
+
+    def __init__(self, workers=4, read_ahead=None):
+        self.workers = max(int(workers), 1)
+        self.read_ahead = max(int(read_ahead or 2 * self.workers), 1)
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def map(self, func, items):
+        items = iter(items)
+        pending = deque(self.executor.submit(func, item)
+                        for item in itertools.islice(items, self.read_ahead))
+        while pending:
+            future = pending.popleft()
+            for item in itertools.islice(items, 1):
+                pending.append(self.executor.submit(func, item))
+            yield future.result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __str__(self):
+        return f'workers: {self.workers}\n' \
+            f'read_ahead: {self.read_ahead}'
+
+
+class FrameSequence:
+    """ Lazy sequence of images, decoded on access.
+
+    Supports len(), indexing, slicing, index arrays and iteration. Decoded frames are kept
+    in a bounded LRU, so only cache_size frames are held at any time. If a
+    DecodePool is given, iteration decodes upcoming frames concurrently.
+    """
+
+    def __init__(self, files, loader=read_image, cache_size=8, pool=None):
+        self.files = list(files)
+        self.loader = loader
+        self.cache = LRUCache(cache_size)
+        self.pool = pool
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, index):
+        if not isinstance(index, numbers.Integral):
+            # slices and index arrays give a new lazy sequence
+            files = self.files[index] if isinstance(index, slice) \
+                else [self.files[i] for i in index]
+            return FrameSequence(files,
+                                 loader=self.loader,
+                                 cache_size=self.cache.maxsize,
+                                 pool=self.pool)
+
+        index = int(index)
+        n_files = len(self.files)
+        if index < 0:
+            index += n_files
+        if not 0 <= index < n_files:
+            raise IndexError("FrameSequence index out of range.")
+
+        frame = self.cache.get(index)
+        if frame is None:
+            frame = self.loader(self.files[index])
+            self.cache.put(index, frame)
+        return frame
+
+    def __iter__(self):
+        if self.pool is None:
+            for index in range(len(self.files)):
+                yield self[index]
+        else:
+            # the cache is only touched from the consuming thread
+            frames = self.pool.map(self.loader, self.files)
+            for index, frame in enumerate(frames):
+                self.cache.put(index, frame)
+                yield frame
+
+    def __str__(self):
+        return f'frames: {len(self.files)}\n' \
+            f'cache_size: {self.cache.maxsize}'
@@ -0,0 +1,96 @@
+import numpy as np
+import open3d as o3d
+
+from .backprojection import voxel_keys, as_o3d_pointcloud
+
+
+def reduce_by_key(keys, *values):
+    # sum values sharing a key, returns sorted unique keys and the sums
+    keys, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    sums = []
+    for value in values:
+        if value.ndim == 1:
+            sums.append(np.bincount(inverse, value, len(keys)))
+        else:
+            sums.append(np.stack([np.bincount(inverse, value[:, i], len(keys))
+                                  for i in range(value.shape[1])], axis=1))
+    return (keys, *sums)
+
+
+class VoxelFusion:
+    """ Streaming point fusion into a voxel hash.
+
+    Frames are consumed one at a time. Every occupied voxel keeps the sum of
+    its points and colors and a count, so positions and colors are running
+    averages and memory is bounded by the number of occupied voxels, not by
+    the number of frames. Frames are buffered up to flush_points before
+    they are merged into the hash.
+    """
+
+    def __init__(self, voxel_size=0.004, flush_points=2000000):
+        self.voxel_size = voxel_size
+        self.flush_points = flush_points
+        self.keys = np.empty(0, dtype=np.int64)
+        self.point_sums = np.empty((0, 3))
+        self.color_sums = np.empty((0, 3))
+        self.counts = np.empty(0)
+        self.pending = []
+        self.n_pending = 0
+        self.n_frames = 0
+
+    def __len__(self):
+        self.flush()
+        return len(self.keys)
+
+    def integrate(self, points, colors=None):
+        if colors is None:
+            colors = np.zeros_like(points)
+        if len(points):
+            self.pending.append(reduce_by_key(voxel_keys(points, self.voxel_size),
+                                              points, colors, np.ones(len(points))))
+            self.n_pending += len(self.pending[-1][0])
+        self.n_frames += 1
+        if self.n_pending >= self.flush_points:
+            self.flush()
+
+    def integrate_frames(self, frames):
+        for points, colors in frames:
+            self.integrate(points, colors)
+        return self
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        keys, point_sums, color_sums, counts = zip(*self.pending)
+        self.keys, self.point_sums, self.color_sums, self.counts = reduce_by_key(
+            np.concatenate((self.keys,) + keys),
+            np.concatenate((self.point_sums,) + point_sums),
+            np.concatenate((self.color_sums,) + color_sums),
+            np.concatenate((self.counts,) + counts))
+        self.pending = []
+        self.n_pending = 0
+
+    def extract(self):
+        self.flush()
+        return (self.point_sums / self.counts[:, None],
+                self.color_sums / self.counts[:, None])
+
+    def as_o3d(self):
+        return as_o3d_pointcloud(*self.extract())
+
+    def write(self, path):
+        return o3d.io.write_point_cloud(path, self.as_o3d(),
+                                        write_ascii=False, compressed=True)
+
+    def memory(self):
+        # bytes held by the hash and the pending frame buffer
+        return sum(a.nbytes for a in (self.keys, self.point_sums,
+                                      self.color_sums, self.counts)) + \
+            sum(a.nbytes for item in self.pending for a in item)
+
+    def __str__(self):
+        return f'voxel_size: {self.voxel_size}\n' \
+            f'frames: {self.n_frames}\n' \
+            f'voxels: {len(self)}'
@@ -1,8 +1,18 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import multiprocessing
 import numpy as np
 import open3d as o3d
+import os
+from scipy.spatial import cKDTree
+import sys
 from tqdm import tqdm
 import copy
 
+from v4r_dataset_toolkit.io import CameraTrajectory
+from v4r_dataset_toolkit.profiling import StageProfiler
+from v4r_dataset_toolkit.voxelindex import VoxelIndex
+
 flip_transform = [[1, 0, 0, 0], [0, -1, 0, 0], [0, 0, -1, 0], [0, 0, 0, 1]]
 
 
@@ -15,19 +25,104 @@ def draw_registration_result_original_color(source, target, transformation):
     o3d.visualization.draw_geometries([source_temp, target_temp])
 
 
+class PointCloudPyramid:
+    """ Voxel downsampled levels of a point cloud for multiscale_icp.
+
+    Levels, their normals and KD-trees are computed on first use and kept,
+    so a cloud registered several times, e.g. the scene reconstruction for
+    every object aligned in it, is downsampled only once per voxel size.
+    A crop selects the points of a sphere from the levels of its parent
+    through a voxel index, which keeps levels and normals identical to the
+    uncropped ones.
+    """
+
+    INDEX_CELL_SIZE = 0.05
+
+    def __init__(self, cloud, parent=None, sphere=None):
+        self.cloud = cloud
+        self.parent = parent
+        self.sphere = sphere
+        self.levels = {}
+        self.has_normals = set()
+        self.kdtrees = {}
+        self.indices = {}
+
+    def level(self, voxel_size, normals=False):
+        down = self.levels.get(voxel_size)
+        if self.parent is not None:
+            if down is None or (normals and voxel_size not in self.has_normals):
+                full = self.parent.level(voxel_size, normals)
+                down = full.select_by_index(
+                    self.parent.index(voxel_size).query_sphere(*self.sphere))
+                self.levels[voxel_size] = down
+                if normals:
+                    self.has_normals.add(voxel_size)
+            return down
+
+        if down is None:
+            down = self.cloud.voxel_down_sample(voxel_size)
+            self.levels[voxel_size] = down
+        if normals and voxel_size not in self.has_normals:
+            down.estimate_normals(
+                o3d.geometry.KDTreeSearchParamHybrid(radius=voxel_size * 2.0,
+                                                     max_nn=30))
+            self.has_normals.add(voxel_size)
+        return down
+
+    def index(self, voxel_size):
+        index = self.indices.get(voxel_size)
+        if index is None:
+            index = VoxelIndex(np.asarray(self.level(voxel_size).points),
+                               self.INDEX_CELL_SIZE)
+            self.indices[voxel_size] = index
+        return index
+
+    def crop(self, center, radius):
+        # pyramid of the points within radius of center
+        return PointCloudPyramid(None, parent=self, sphere=(np.asarray(center), radius))
+
+    def kdtree(self, voxel_size):
+        # scipy tree, queries many points in one vectorized call
+        tree = self.kdtrees.get(voxel_size)
+        if tree is None:
+            tree = cKDTree(np.asarray(self.level(voxel_size).points))
+            self.kdtrees[voxel_size] = tree
+        return tree
+
+    def nbytes(self):
+        # points, normals and colors in double
+        return sum(len(x.points) * 72 for x in self.levels.values())
+
+    def __str__(self):
+        points = len(self.cloud.points) if self.cloud is not None else 'cropped'
+        return f'points: {points}\n' \
+            f'levels: {", ".join(f"{k}: {len(v.points)}" for k, v in sorted(self.levels.items()))}'
+
+
+def as_pyramid(cloud):
+    if isinstance(cloud, PointCloudPyramid):
+        return cloud
+    return PointCloudPyramid(cloud)
+
+
 def multiscale_icp(source,
                    target,
                    voxel_size,
                    max_iter,
                    config,
                    init_transformation=np.identity(4)):
+    # source and target are point clouds or PointCloudPyramids, levels and
+    # normals of pyramids are reused between calls
+    source = as_pyramid(source)
+    target = as_pyramid(target)
+    normals = config.get("icp_method") in ("point_to_plane", "color")
     current_transformation = init_transformation
     for i, scale in enumerate(range(len(max_iter))):  # multi-scale approach
         iter = max_iter[scale]
         distance_threshold = float(config.get("voxel_size")) * 1.4
         # print("voxel_size %f" % voxel_size[scale])
-        source_down = source.voxel_down_sample(voxel_size[scale])
-        target_down = target.voxel_down_sample(voxel_size[scale])
+        source_down = source.level(voxel_size[scale], normals)
+        target_down = target.level(voxel_size[scale], normals)
 
         if config.get("icp_method") == "point_to_point":
             result_icp = o3d.pipelines.registration.registration_icp(
@@ -53,14 +148,6 @@ def multiscale_icp(source,
                 criteria=conv_criteria)
             print(result_icp)
         else:
-            source_down.estimate_normals(
-                o3d.geometry.KDTreeSearchParamHybrid(radius=voxel_size[scale] *
-                                                     2.0,
-                                                     max_nn=30))
-            target_down.estimate_normals(
-                o3d.geometry.KDTreeSearchParamHybrid(radius=voxel_size[scale] *
-                                                     2.0,
-                                                     max_nn=30))
             if config.get("icp_method") == "point_to_plane":
                 # check if pointcloud has normals
                 result_icp = o3d.pipelines.registration.registration_icp(
@@ -92,29 +179,175 @@ def multiscale_icp(source,
                 source_down, target_down, voxel_size[scale] * 1.4,
                 result_icp.transformation)
 
-    return (result_icp.transformation, information_matrix)
+    # the result of the finest scale holds fitness and inlier_rmse
+    return (result_icp.transformation, information_matrix, result_icp)
+
+
+def frame_cloud(rgbd, intrinsic, pose):
+    # world points and colors of a frame as arrays, which are cheap to send to workers
+    cloud = o3d.geometry.PointCloud.create_from_rgbd_image(rgbd, intrinsic, pose)
+    return np.asarray(cloud.points), np.asarray(cloud.colors)
+
 
+def as_pointcloud(cloud):
+    points, colors = cloud
+    pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points))
+    pcd.colors = o3d.utility.Vector3dVector(colors)
+    return pcd
 
-def icp_refinement(rgbds, poses, intrinsic, config):
+
+def register_clouds(source, target, config):
+    # (transformation, quality) of the source onto the target cloud, both
+    # (points, colors), quality holds fitness, inlier rmse and the distance
+    # the transformation moves the source centroid
     voxel_size = float(config.get("voxel_size"))
+    transfo, information_mat, result = multiscale_icp(
+        as_pointcloud(source),
+        as_pointcloud(target),
+        [2*voxel_size, voxel_size, voxel_size/2.0, voxel_size/4.0],
+        [100, 50, 30, 14],
+        config,
+        init_transformation=np.identity(4))
+    centroid = np.asarray(source[0]).mean(axis=0)
+    motion = np.linalg.norm(transfo[:3, :3] @ centroid + transfo[:3, 3] - centroid)
+    return transfo, {'fitness': result.fitness,
+                     'rmse': result.inlier_rmse,
+                     'motion': float(motion)}
+
+
+class PairwiseRefiner:
+    """ Refines camera extrinsics by registering consecutive frames.
+
+    Each frame's cloud is built once and registered to the previous frame
+    with the initial poses of both, so the pairs are independent and run in
+    a pool of jobs processes. Since the previous frame is corrected as well,
+    the corrections are composed in frame order afterwards:
+    C_i = T_i @ C_(i-1) and the refined extrinsic is pose_i @ C_i.
+
+    A pair with a fitness below refine_min_fitness, an inlier rmse above
+    refine_max_rmse (default: voxel_size) or which moves the cloud further
+    than refine_max_motion meter is rejected and counts as identity, so the
+    frame keeps the correction of the previous frame and a failed
+    registration does not move the rest of the trajectory. The motion bound
+    catches registrations sliding along planar scenes, which keep a good
+    fitness. rejected lists the positions of rejected frames in the order
+    they were added.
+    """
+
+    # every worker holds an interpreter with open3d and two clouds, more
+    # workers rarely pay off since frames are loaded in a single process
+    MAX_JOBS = 4
+    MIN_FITNESS = 0.3
+    MAX_MOTION = 0.05
+
+    def __init__(self, intrinsic, config, jobs=1, correction=None):
+        self.intrinsic = intrinsic
+        self.config = dict(config)
+        self.jobs = max(int(jobs or 1), 1)
+        self.executor = None
+        if self.jobs > 1:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.jobs, mp_context=multiprocessing.get_context("spawn"))
+        # correction of the frame before the first added one, e.g. on resume
+        self.correction = np.identity(4) if correction is None else np.asarray(correction)
+        self.previous = None
+        self.pending = deque()
+        self.min_fitness = float(self.config.get("refine_min_fitness") or self.MIN_FITNESS)
+        self.max_rmse = float(self.config.get("refine_max_rmse") or self.config.get("voxel_size"))
+        self.max_motion = float(self.config.get("refine_max_motion") or self.MAX_MOTION)
+        self.rejected = []
+        self.added = 0
+
+    def accept(self, quality):
+        return quality['fitness'] >= self.min_fitness and \
+            quality['rmse'] <= self.max_rmse and \
+            quality['motion'] <= self.max_motion
+
+    @classmethod
+    def jobs_for(cls, config):
+        # refine_jobs or the number of cores up to MAX_JOBS
+        return int(config.get("refine_jobs") or min(os.cpu_count() or 1, cls.MAX_JOBS))
+
+    @classmethod
+    def create(cls, intrinsic, config, correction=None):
+        return cls(intrinsic, config, cls.jobs_for(config), correction)
+
+    def add(self, rgbd, pose, item=None):
+        # item is handed back with the refined pose
+        cloud = frame_cloud(rgbd, self.intrinsic, pose)
+        if self.previous is None:
+            transfo = None
+        elif self.executor is None:
+            transfo = register_clouds(self.previous, cloud, self.config)
+        else:
+            transfo = self.executor.submit(register_clouds, self.previous, cloud, self.config)
+        self.previous = cloud
+        self.pending.append((transfo, np.asarray(pose), self.added, item))
+        self.added += 1
+
+    def results(self, max_pending=0):
+        # yields (refined pose, item) in frame order as pairs finish, waits
+        # while more than max_pending frames are outstanding
+        while self.pending:
+            transfo, pose, position, item = self.pending[0]
+            if isinstance(transfo, Future):
+                if len(self.pending) <= max_pending and not transfo.done():
+                    return
+                transfo = transfo.result()
+            self.pending.popleft()
+            if transfo is not None:
+                transfo, quality = transfo
+                if self.accept(quality):
+                    self.correction = np.dot(transfo, self.correction)
+                else:
+                    self.rejected.append(position)
+            yield np.dot(pose, self.correction), item
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True) \
+                if sys.version_info >= (3, 9) else self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __str__(self):
+        return f'jobs: {self.jobs}\n' \
+            f'pending: {len(self.pending)}\n' \
+            f'rejected: {len(self.rejected)}'
+
+
+def icp_refinement(rgbds, poses, intrinsic, config, profiler=None):
+    # poses are camera extrinsics, refined in place when given as array or list
+    # rgbds may be any iterable, frames are released once their pair is submitted
+    if profiler is None:
+        profiler = StageProfiler()
+    trajectory = None
+    if isinstance(poses, CameraTrajectory):
+        trajectory = poses
+        poses = trajectory.matrices.copy()
+
+    with PairwiseRefiner.create(intrinsic, config) as refiner:
+        window = 2 * refiner.jobs
+        for frame_id, rgbd in enumerate(tqdm(profiler.iterate("load", rgbds),
+                                             total=len(poses), desc="Refinement")):
+            with profiler.stage("refine"):
+                refiner.add(rgbd, poses[frame_id], frame_id)
+                for pose, index in refiner.results(window):
+                    poses[index] = pose
+        with profiler.stage("refine"):
+            for pose, index in refiner.results():
+                poses[index] = pose
+        if refiner.rejected:
+            print(f"Rejected {len(refiner.rejected)} of {len(poses) - 1} frame pairs: "
+                  f"{refiner.rejected}")
 
-    for frame_id in tqdm(range(1, len(rgbds), 1), desc="Refinement"):
-        source = o3d.geometry.PointCloud.create_from_rgbd_image(
-            rgbds[frame_id-1],
-            intrinsic,
-            poses[frame_id-1])
-
-        target = o3d.geometry.PointCloud.create_from_rgbd_image(
-            rgbds[frame_id],
-            intrinsic,
-            poses[frame_id])
-
-        transfo, information_mat = multiscale_icp(
-            source,
-            target,
-            [2*voxel_size, voxel_size, voxel_size/2.0, voxel_size/4.0],
-            [100, 50, 30, 14],
-            config,
-            init_transformation=np.identity(4))
-
-        poses[frame_id] = np.dot(poses[frame_id], transfo)
+    if trajectory is not None:
+        return CameraTrajectory.from_matrices(poses,
+                                              ids=trajectory.ids,
+                                              camera_info=trajectory.camera_info)
+    return poses
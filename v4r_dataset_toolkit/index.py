@@ -0,0 +1,200 @@
+import json
+import os
+import tempfile
+import warnings
+
+RGB_EXTENSIONS = ('.png', '.jpg')
+DEPTH_EXTENSIONS = ('.png',)
+
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def scan_frames(path, extensions):
+    # sorted frame paths relative to path and the mtime of every visited dir
+    files = []
+    dirs = {'.': get_mtime(path)}
+    for root, _, filenames in os.walk(path):
+        dirs[os.path.relpath(root, path)] = get_mtime(root)
+        for filename in filenames:
+            if filename.endswith(extensions):
+                files.append(os.path.relpath(
+                    os.path.join(root, filename), path))
+    files.sort()
+    return {'dirs': dirs, 'files': files}
+
+
+class DatasetIndex:
+    """ Persistent index of the dataset layout.
+
+    Stores scene ids, sorted frame paths, intrinsics and pose file locations and
+    annotation presence in one json file per dataset. Entries are validated
+    against the recorded directory and file mtimes once per session and only
+    stale parts are rescanned.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path, scenes_root, rgb_dir, depth_dir,
+                 camera_intrinsics_file, camera_pose_file,
+                 annotation_root, object_pose_file):
+        self.path = path
+        self.scenes_root = scenes_root
+        self.rgb_dir = rgb_dir
+        self.depth_dir = depth_dir
+        self.camera_intrinsics_file = camera_intrinsics_file
+        self.camera_pose_file = camera_pose_file
+        self.annotation_root = annotation_root
+        self.object_pose_file = object_pose_file
+        self.data = self.load()
+        self.validated = set()
+        self.dirty = False
+        # set after a failed write, the index then stays in memory only
+        self.read_only = False
+
+    def layout(self):
+        # changing any of these settings invalidates the whole index
+        return {'version': self.VERSION,
+                'scenes_root': self.scenes_root,
+                'rgb_dir': self.rgb_dir,
+                'depth_dir': self.depth_dir,
+                'camera_intrinsics_file': self.camera_intrinsics_file,
+                'camera_pose_file': self.camera_pose_file,
+                'annotation_root': self.annotation_root,
+                'object_pose_file': self.object_pose_file}
+
+    def load(self):
+        empty = {'layout': self.layout(), 'mtime': None,
+                 'scene_ids': [], 'scenes': {}}
+        if not os.path.exists(self.path):
+            return empty
+
+        try:
+            with open(self.path, 'r') as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return empty
+
+        if data.get('layout') != self.layout():
+            return empty
+        return data
+
+    def save(self):
+        if not self.dirty or self.read_only:
+            return
+
+        # a temporary file per writer, parallel reconstructions save concurrently
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.',
+                                            suffix='.tmp')
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(self.data, fp)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+        except OSError as e:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            # read-only datasets still work, the index is just not persisted
+            self.read_only = True
+            warnings.warn(f"Could not write dataset index {self.path}: {e}")
+
+    def scene_ids(self):
+        mtime = get_mtime(self.scenes_root)
+        if mtime != self.data['mtime']:
+            scene_ids = sorted(
+                [f.name for f in os.scandir(self.scenes_root) if f.is_dir()])
+            self.data['mtime'] = mtime
+            self.data['scene_ids'] = scene_ids
+            self.data['scenes'] = {scene_id: entry for scene_id, entry
+                                   in self.data['scenes'].items()
+                                   if scene_id in scene_ids}
+            self.dirty = True
+            self.save()
+        return list(self.data['scene_ids'])
+
+    def update(self, scene_ids=None):
+        for scene_id in scene_ids or self.scene_ids():
+            self.scene(scene_id)
+
+    def scene(self, scene_id):
+        entry = self.data['scenes'].get(scene_id)
+        if entry is None or scene_id not in self.validated:
+            entry = self.refresh_scene(scene_id, entry or {})
+            self.validated.add(scene_id)
+            self.save()
+        return entry
+
+    def refresh_scene(self, scene_id, entry):
+        scene_dir = os.path.join(self.scenes_root, scene_id)
+
+        for key, sub_dir, extensions in [('rgb', self.rgb_dir, RGB_EXTENSIONS),
+                                         ('depth', self.depth_dir, DEPTH_EXTENSIONS)]:
+            frames_dir = os.path.join(scene_dir, sub_dir)
+            frames = entry.get(key)
+            if frames is None or any(get_mtime(os.path.join(frames_dir, d)) != mtime
+                                     for d, mtime in frames['dirs'].items()):
+                entry[key] = scan_frames(frames_dir, extensions)
+                self.dirty = True
+
+        # per scene intrinsics take precedence over dataset wide ones
+        intrinsics_path = None
+        candidates = [os.path.join(scene_dir, self.camera_intrinsics_file),
+                      os.path.join(self.scenes_root, self.camera_intrinsics_file)] \
+            if self.camera_intrinsics_file else []
+        for path in candidates:
+            if os.path.exists(path):
+                intrinsics_path = path
+                break
+        intrinsics = entry.get('intrinsics')
+        if intrinsics_path is None:
+            if intrinsics is not None or 'intrinsics' not in entry:
+                entry['intrinsics'] = None
+                self.dirty = True
+        elif (intrinsics is None or intrinsics['path'] != intrinsics_path or
+              intrinsics['mtime'] != get_mtime(intrinsics_path)):
+            # the file is parsed by whoever loads the camera info
+            entry['intrinsics'] = {'path': intrinsics_path,
+                                   'mtime': get_mtime(intrinsics_path)}
+            self.dirty = True
+
+        # entries of files which are not configured are None
+        for key, directory, file in [('pose_file', scene_dir, self.camera_pose_file),
+                                     ('annotation', os.path.join(self.annotation_root, scene_id),
+                                      self.object_pose_file)]:
+            value = None
+            if file:
+                path = os.path.join(directory, file)
+                value = {'path': path, 'mtime': get_mtime(path)}
+            if key not in entry or entry[key] != value:
+                entry[key] = value
+                self.dirty = True
+
+        if scene_id in self.data['scene_ids']:
+            self.data['scenes'][scene_id] = entry
+        return entry
+
+    def frames(self, scene_id, key):
+        frames_dir = os.path.join(self.scenes_root, scene_id,
+                                  self.rgb_dir if key == 'rgb' else self.depth_dir)
+        return [os.path.join(frames_dir, file)
+                for file in self.scene(scene_id)[key]['files']]
+
+    def intrinsics(self, scene_id):
+        return self.scene(scene_id)['intrinsics']
+
+    def pose_file(self, scene_id):
+        pose_file = self.scene(scene_id)['pose_file']
+        return pose_file['path'] if pose_file else None
+
+    def has_annotation(self, scene_id):
+        annotation = self.scene(scene_id)['annotation']
+        return annotation is not None and annotation['mtime'] is not None
+
+    def __str__(self):
+        return f'index_file: {self.path}\n' \
+            f'scenes: {len(self.data["scene_ids"])}'
@@ -5,9 +5,20 @@ import yaml
 import glob
 import math
 import errno
+import copy
+import json
 
 from .objects import ObjectLibrary
 from .meshreader import MeshReader
+from .frames import FrameSequence, DecodePool, read_image_pair
+from .index import DatasetIndex, RGB_EXTENSIONS, DEPTH_EXTENSIONS
+from .backprojection import BackProjector, as_o3d_pointcloud
+from .fusion import VoxelFusion
+from .manifest import ReconstructionManifest
+from .features import FEATURE_VOXEL_SIZE, cached_features, file_key
+
+# libyaml based loader is much faster, fall back to the pure python one
+YAML_LOADER = getattr(yaml, 'CFullLoader', yaml.FullLoader)
 
 
 def get_file_list(path, extensions):
@@ -21,6 +32,93 @@ def get_file_list(path, extensions):
     return file_list
 
 
+def quaternion_to_rotation_matrix(quaternions):
+    # batched conversion of (N,4) quaternions w, x, y, z to (N,3,3) matrices
+    q = np.asarray(quaternions, dtype=np.float64).reshape(-1, 4)
+    q = q / np.linalg.norm(q, axis=1, keepdims=True)
+    w, x, y, z = q.T
+
+    rotations = np.empty((len(q), 3, 3))
+    rotations[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    rotations[:, 0, 1] = 2 * (x * y - z * w)
+    rotations[:, 0, 2] = 2 * (x * z + y * w)
+    rotations[:, 1, 0] = 2 * (x * y + z * w)
+    rotations[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    rotations[:, 1, 2] = 2 * (y * z - x * w)
+    rotations[:, 2, 0] = 2 * (x * z - y * w)
+    rotations[:, 2, 1] = 2 * (y * z + x * w)
+    rotations[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return rotations
+
+
+def rotation_matrix_to_quaternion(rotations):
+    # batched conversion of (N,3,3) matrices to (N,4) quaternions w, x, y, z
+    m = np.asarray(rotations, dtype=np.float64).reshape(-1, 3, 3)
+    trace = m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2]
+    decision = np.stack([m[:, 0, 0], m[:, 1, 1], m[:, 2, 2], trace], axis=1)
+    choice = decision.argmax(axis=1)
+
+    # x, y, z, w; pick the numerically most stable formula per rotation
+    q = np.empty((len(m), 4))
+    for i in range(3):
+        j = (i + 1) % 3
+        k = (j + 1) % 3
+        sel = choice == i
+        q[sel, i] = 1 - trace[sel] + 2 * m[sel, i, i]
+        q[sel, j] = m[sel, j, i] + m[sel, i, j]
+        q[sel, k] = m[sel, k, i] + m[sel, i, k]
+        q[sel, 3] = m[sel, k, j] - m[sel, j, k]
+    sel = choice == 3
+    q[sel, 0] = m[sel, 2, 1] - m[sel, 1, 2]
+    q[sel, 1] = m[sel, 0, 2] - m[sel, 2, 0]
+    q[sel, 2] = m[sel, 1, 0] - m[sel, 0, 1]
+    q[sel, 3] = 1 + trace[sel]
+
+    q = q[:, [3, 0, 1, 2]]
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    q[q[:, 0] < 0] *= -1
+    return q
+
+
+def quaternion_multiply(q1, q2):
+    # batched hamilton product of (N,4) quaternions w, x, y, z
+    w1, x1, y1, z1 = np.moveaxis(q1, -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(q2, -1, 0)
+    return np.stack([w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+                     w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                     w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                     w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2], axis=-1)
+
+
+def read_pose_file(path):
+    """ Read a trajectory file in one pass.
+
+    Each line holds: id tx ty tz rx ry rz rw
+    Returns the frame ids, (N,3) translations and (N,4) quaternions w, x, y, z.
+    """
+    values = np.loadtxt(path, dtype=str, ndmin=2)
+    if values.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty((0, 3)), np.empty((0, 4))
+
+    try:
+        ids = values[:, 0].astype(np.int64)
+    except ValueError:
+        ids = values[:, 0]
+
+    values = values[:, 1:8].astype(np.float64)
+    return ids, values[:, :3], values[:, [6, 3, 4, 5]]
+
+
+def read_camera_poses(path):
+    # Returns the frame ids and a contiguous (N,4,4) float64 array of poses.
+    ids, translations, quaternions = read_pose_file(path)
+    poses = np.zeros((len(ids), 4, 4))
+    poses[:, 3, 3] = 1
+    poses[:, :3, 3] = translations
+    poses[:, :3, :3] = quaternion_to_rotation_matrix(quaternions)
+    return ids, poses
+
+
 class Pose:
     def __init__(self, values=None, wxyz=True):
         if type(values) == list:
@@ -119,34 +217,149 @@ class CameraInfo:
     def fov(self):
         return 2 * math.atan(self.width / (2 * self.fx))
 
+    @classmethod
+    def from_dict(cls, cam):
+        return cls(name=cam.get('name'),
+                   width=cam.get('image_width'),
+                   height=cam.get('image_height'),
+                   fx=cam.get('camera_matrix')[0],
+                   fy=cam.get('camera_matrix')[4],
+                   cx=cam.get('camera_matrix')[2],
+                   cy=cam.get('camera_matrix')[5],
+                   sensor_width=cam.get('sensor_width'))
+
     @classmethod
     def create(cls, file):
         # Read width, height and intrinsics from yaml file
         with open(file, 'r') as fp:
-            cam = yaml.load(fp, Loader=yaml.FullLoader)
-            return cls(name=cam.get('name'),
-                       width=cam.get('image_width'),
-                       height=cam.get('image_height'),
-                       fx=cam.get('camera_matrix')[0],
-                       fy=cam.get('camera_matrix')[4],
-                       cx=cam.get('camera_matrix')[2],
-                       cy=cam.get('camera_matrix')[5],
-                       sensor_width=cam.get('sensor_width'))
+            return cls.from_dict(yaml.load(fp, Loader=YAML_LOADER))
         return None
 
 
 class CameraTrajectory:
-    def __init__(self, camera_info, poses=[]):
+    """ Camera poses stored as arrays instead of a list of Pose objects.
+
+    Holds (N,3) translations, (N,4) quaternions w, x, y, z and the frame ids.
+    The (N,4,4) matrix stack is computed once on first access. All
+    operations work on the whole trajectory at once.
+    """
+
+    def __init__(self, translations=None, quaternions=None, ids=None, camera_info=None):
+        self.translations = np.ascontiguousarray(
+            translations if translations is not None else np.empty((0, 3)),
+            dtype=np.float64).reshape(-1, 3)
+        if quaternions is None:
+            quaternions = np.tile([1.0, 0, 0, 0], (len(self.translations), 1))
+        quaternions = np.asarray(quaternions, dtype=np.float64).reshape(-1, 4)
+        self.quaternions = np.ascontiguousarray(
+            quaternions / np.linalg.norm(quaternions, axis=1, keepdims=True))
+        self.ids = np.asarray(
+            ids if ids is not None else np.arange(len(self.translations)))
         self.camera_info = camera_info
-        self.poses = poses
+        self._matrices = None
+
+        if not len(self.translations) == len(self.quaternions) == len(self.ids):
+            raise ValueError("CameraTrajectory arrays differ in length.")
+
+    @classmethod
+    def from_matrices(cls, matrices, ids=None, camera_info=None):
+        matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4)
+        trajectory = cls(matrices[:, :3, 3],
+                         rotation_matrix_to_quaternion(matrices[:, :3, :3]),
+                         ids=ids,
+                         camera_info=camera_info)
+        trajectory._matrices = np.ascontiguousarray(matrices)
+        return trajectory
+
+    @classmethod
+    def from_file(cls, pose_file, camera_info=None):
+        ids, translations, quaternions = read_pose_file(pose_file)
+        return cls(translations, quaternions, ids=ids, camera_info=camera_info)
 
     @classmethod
     def create(cls, camera_file, pose_file):
-        # Read camera params.
-        # TODO: Think of nested settings: global or per scene camera intrinsics
-        self.camera_info = CameraInfo.create(camera_file)
-        # Read poses, now they are different than object poses
-        # camera: plane text, id, quaternion   object: yaml file id, 4x4 matrix
+        return cls.from_file(pose_file, camera_info=CameraInfo.create(camera_file))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['translations'], data['quaternions'], ids=data['ids'])
+
+    def save(self, path):
+        # compact binary format, keeps the exact file name
+        with open(path, 'wb') as fp:
+            np.savez(fp,
+                     ids=self.ids,
+                     translations=self.translations,
+                     quaternions=self.quaternions)
+
+    def save_txt(self, path):
+        # same format as the camera pose file: id tx ty tz rx ry rz rw
+        values = np.hstack([self.translations, self.quaternions[:, [1, 2, 3, 0]]])
+        with open(path, 'w') as fp:
+            for frame_id, row in zip(self.ids, values.astype(str)):
+                fp.write(" ".join([str(frame_id)] + list(row)) + "\n")
+
+    @property
+    def matrices(self):
+        if self._matrices is None:
+            matrices = np.zeros((len(self), 4, 4))
+            matrices[:, 3, 3] = 1
+            matrices[:, :3, 3] = self.translations
+            matrices[:, :3, :3] = quaternion_to_rotation_matrix(self.quaternions)
+            self._matrices = matrices
+        return self._matrices
+
+    def rotations(self):
+        return self.matrices[:, :3, :3]
+
+    def inverse(self):
+        rotations_t = np.swapaxes(self.rotations(), 1, 2)
+        translations = -np.einsum('nij,nj->ni', rotations_t, self.translations)
+        quaternions = self.quaternions * [1, -1, -1, -1]
+        return CameraTrajectory(translations, quaternions,
+                                ids=self.ids, camera_info=self.camera_info)
+
+    def compose(self, other):
+        # self[i] * other[i]; other can be a trajectory, (4,4) or (N,4,4)
+        if not isinstance(other, CameraTrajectory):
+            other = CameraTrajectory.from_matrices(other)
+        if len(other) != len(self) and len(other) != 1:
+            raise ValueError("CameraTrajectory lengths do not match.")
+
+        translations = np.einsum('nij,nj->ni', self.rotations(),
+                                 np.broadcast_to(other.translations, self.translations.shape)) \
+            + self.translations
+        quaternions = quaternion_multiply(self.quaternions, other.quaternions)
+        return CameraTrajectory(translations, quaternions,
+                                ids=self.ids, camera_info=self.camera_info)
+
+    def relative(self, step=1):
+        # motion between frame i and i + step: inv(T_i) * T_{i + step}
+        return self[:-step].inverse().compose(self[step:])
+
+    def __len__(self):
+        return len(self.translations)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return Pose(self.matrices[index])
+
+        trajectory = CameraTrajectory(self.translations[index],
+                                      self.quaternions[index],
+                                      ids=self.ids[index],
+                                      camera_info=self.camera_info)
+        if self._matrices is not None:
+            trajectory._matrices = self._matrices[index]
+        return trajectory
+
+    def __iter__(self):
+        for matrix in self.matrices:
+            yield Pose(matrix)
+
+    def __str__(self):
+        return f'poses: {len(self)}\n' \
+            f'camera_info: {self.camera_info is not None}'
 
 
 class ObjectPose:
@@ -181,13 +394,45 @@ class SceneFileReader:
         self.reconstruction_file = 'reconstruction.ply'
         self.reconstruction_visual_file = 'reconstruction_visual.ply'
         self.reconstruction_align_file = 'reconstruction_align.ply'
+        self.reconstruction_fused_file = 'reconstruction_fused.ply'
+        self.reconstruction_manifest_file = 'reconstruction_manifest.json'
+        self.reconstruction_visual_lods_file = 'reconstruction_visual_lods.json'
+        # triangle budget for the visual reconstruction, None loads the full mesh
+        self.reconstruction_visual_max_triangles = config.get(
+            'reconstruction_visual_max_triangles')
         self.mask_dir = config.get('mask_dir')
+        # False disables the binary mesh cache, None uses the default location
+        self.mesh_cache_dir = config.get('mesh_cache_dir')
+        self.geometry_cache_mb = config.get('geometry_cache_mb', 1024)
+        if self.mesh_cache_dir and not os.path.isabs(self.mesh_cache_dir):
+            self.mesh_cache_dir = os.path.join(
+                self.root_dir, self.mesh_cache_dir)
+        self.annotation_dir = config.get('annotation_dir')
+        self.camera_info_cache = {}
+        self.camera_info_stats = {'hits': 0, 'misses': 0}
+        self.index = None
+        if config.get('dataset_index', True):
+            self.index = DatasetIndex(
+                os.path.join(self.root_dir,
+                             config.get('dataset_index_file', '.dataset_index.json')),
+                os.path.join(self.root_dir, self.scenes_dir),
+                self.rgb_dir,
+                self.depth_dir,
+                self.camera_intrinsics_file,
+                self.camera_pose_file,
+                os.path.join(self.root_dir, self.annotation_dir),
+                self.object_pose_file)
         self.scene_ids = self.get_scene_ids()
         self.object_library = self.get_object_library()
-        self.annotation_dir = config.get('annotation_dir')
         self.object_scale = config.get('object_scale')
         if not self.object_scale:
             self.object_scale = 1
+        self.frame_cache_size = config.get('frame_cache_size', 8)
+        # decode_workers: 0 reads images serially in the calling thread
+        self.decode_workers = config.get('decode_workers', 0)
+        self.decode_read_ahead = config.get('decode_read_ahead')
+        self.decode_pool = DecodePool(
+            self.decode_workers, self.decode_read_ahead) if self.decode_workers else None
 
     @classmethod
     def create(cls, config_file):
@@ -244,8 +489,14 @@ class SceneFileReader:
             f'reconstruction_file: {self.reconstruction_file}\n'\
             f'reconstruction_visual_file: {self.reconstruction_visual_file}\n'\
             f'reconstruction_align_file: {self.reconstruction_align_file}\n'\
+            f'reconstruction_fused_file: {self.reconstruction_fused_file}\n'\
+            f'reconstruction_manifest_file: {self.reconstruction_manifest_file}\n'\
+            f'reconstruction_visual_lods_file: {self.reconstruction_visual_lods_file}\n'\
             f'annotation_dir: {self.annotation_dir}\n'\
-            f'mask_dir: {self.mask_dir}'
+            f'mask_dir: {self.mask_dir}\n'\
+            f'frame_cache_size: {self.frame_cache_size}\n'\
+            f'decode_workers: {self.decode_workers}\n'\
+            f'dataset_index: {self.index.path if self.index else None}'
 
     def get_camera_info_scene_path(self, scene_id):
         full_path_scene_cam = os.path.join(
@@ -253,78 +504,188 @@ class SceneFileReader:
 
         return full_path_scene_cam
 
-    def get_camera_info_scene(self, scene_id):
+    def load_camera_info(self, path):
+        # memoized by resolved path, reparsed only if the file was modified
+        path = os.path.realpath(path)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.camera_info_cache.get(path)
+        if cached and cached[0] == mtime:
+            self.camera_info_stats['hits'] += 1
+        else:
+            self.camera_info_stats['misses'] += 1
+            cached = (mtime, CameraInfo.create(path))
+            self.camera_info_cache[path] = cached
+        return copy.copy(cached[1])
+
+    def camera_info_cache_stats(self):
+        stats = dict(self.camera_info_stats)
+        calls = stats['hits'] + stats['misses']
+        stats['entries'] = len(self.camera_info_cache)
+        stats['hit_rate'] = stats['hits'] / calls if calls else 0.0
+        return stats
+
+    def find_camera_info_path(self, scene_id):
+        # per scene intrinsics take precedence over dataset wide ones
         full_path_scene_cam = self.get_camera_info_scene_path(scene_id)
         full_path = os.path.join(
             self.root_dir, self.scenes_dir, self.camera_intrinsics_file)
 
-        if os.path.exists(full_path_scene_cam):
-            return CameraInfo.create(full_path_scene_cam)
+        if self.index:
+            intrinsics = self.index.intrinsics(scene_id)
+            if intrinsics:
+                return intrinsics['path']
+        elif os.path.exists(full_path_scene_cam):
+            return full_path_scene_cam
         elif os.path.exists(full_path):
-            return CameraInfo.create(full_path)
-        else:
-            raise FileNotFoundError(
-                errno.ENOENT, os.strerror(errno.ENOENT), full_path)
+            return full_path
+
+        raise FileNotFoundError(
+            errno.ENOENT, os.strerror(errno.ENOENT), full_path)
+
+    def get_camera_info_scene(self, scene_id):
+        return self.load_camera_info(self.find_camera_info_path(scene_id))
 
     def get_object_library(self):
-        return ObjectLibrary.create(self.object_library_file)
+        return ObjectLibrary.create(self.object_library_file,
+                                    mesh_cache_dir=self.mesh_cache_dir,
+                                    geometry_cache_bytes=int(self.geometry_cache_mb * (1 << 20)))
 
     def get_scene_ids(self):
+        if self.index:
+            return self.index.scene_ids()
+
         full_path = os.path.join(self.root_dir, self.scenes_dir)
         return sorted([f.name for f in os.scandir(full_path) if f.is_dir()])
 
-    def get_camera_poses(self, scene_id):
-        # check if id is in this datasets scene id list
-        full_path = os.path.join(
+    def get_camera_poses_path(self, scene_id):
+        if self.index:
+            return self.index.pose_file(scene_id)
+
+        return os.path.join(
             self.root_dir, self.scenes_dir, scene_id, self.camera_pose_file)
-        with open(full_path) as fp:
-            pose_lines = fp.readlines()
-        # The recorded poses adds line entries -> disregard first entry
-        return [Pose(line.strip().split()[1:], wxyz=False) for line in pose_lines]
+
+    def get_camera_poses_array(self, scene_id):
+        return read_camera_poses(self.get_camera_poses_path(scene_id))
+
+    def get_camera_trajectory(self, scene_id):
+        return CameraTrajectory.from_file(self.get_camera_poses_path(scene_id),
+                                          camera_info=self.get_camera_info_scene(scene_id))
+
+    def get_camera_poses(self, scene_id):
+        # Pose objects only wrap views into the pose array
+        _, poses = self.get_camera_poses_array(scene_id)
+        return [Pose(pose) for pose in poses]
+
+    def get_frames_rgb(self, scene_id):
+        return FrameSequence(self.get_images_rgb_path(scene_id),
+                             cache_size=self.frame_cache_size,
+                             pool=self.decode_pool)
 
     def get_images_rgb(self, scene_id):
-        files = self.get_images_rgb_path(scene_id)
-        return [o3d.io.read_image(file) for file in files]
+        return list(self.get_frames_rgb(scene_id))
 
     def get_images_rgb_path(self, scene_id):
+        if self.index:
+            return self.index.frames(scene_id, 'rgb')
+
         full_path = os.path.join(
             self.root_dir, self.scenes_dir, scene_id, self.rgb_dir)
 
-        extensions = ('.png', '.jpg')
-        files = get_file_list(full_path, extensions)
+        files = get_file_list(full_path, RGB_EXTENSIONS)
         files.sort()
         return files
 
+    def get_frames_depth(self, scene_id):
+        return FrameSequence(self.get_images_depth_path(scene_id),
+                             cache_size=self.frame_cache_size,
+                             pool=self.decode_pool)
+
     def get_images_depth(self, scene_id):
-        files = self.get_images_depth_path(scene_id)
-        return [o3d.io.read_image(file) for file in files]
+        return list(self.get_frames_depth(scene_id))
 
     def get_images_depth_path(self, scene_id):
+        if self.index:
+            return self.index.frames(scene_id, 'depth')
+
         full_path = os.path.join(
             self.root_dir, self.scenes_dir, scene_id, self.depth_dir)
 
-        extensions = ('.png')
-        files = get_file_list(full_path, extensions)
+        files = get_file_list(full_path, DEPTH_EXTENSIONS)
         files.sort()
         return files
 
-    def get_pointclouds(self, scene_id):
-        # return rgbd image reader which does not load images right away?
-        # at loading it will use camera info, rgb and depth to create the rgbd image
-        # with the help of open3d (maybe just the mesh?)
-        rgb_images = self.get_images_rgb(scene_id)
-        depth_images = self.get_images_depth(scene_id)
-        camera_info = self.get_camera_info_scene(scene_id).as_o3d()
-        camera_poses = self.get_camera_poses(scene_id)
-        pointclouds = []
-        for i, camera_pose in enumerate(camera_poses):
-            rgbd_image = o3d.geometry.RGBDImage.create_from_color_and_depth(
-                rgb_images[i], depth_images[i], convert_rgb_to_intensity=False)
-            pcd = o3d.geometry.PointCloud.create_from_rgbd_image(
-                rgbd_image, camera_info)
-            pointclouds.append(pcd.transform(camera_pose.tf))
-
-        return pointclouds
+    def get_frames_rgbd(self, scene_id):
+        # yields (rgb, depth) tuples, decoded together
+        files = zip(self.get_images_rgb_path(scene_id),
+                    self.get_images_depth_path(scene_id))
+        return FrameSequence(files,
+                             loader=read_image_pair,
+                             cache_size=self.frame_cache_size,
+                             pool=self.decode_pool)
+
+    def get_backprojector(self, scene_id, stride=1, min_depth=0.0, max_depth=3.0):
+        return BackProjector(self.get_camera_info_scene(scene_id),
+                             stride=stride,
+                             min_depth=min_depth,
+                             max_depth=max_depth)
+
+    def iter_pointcloud_arrays(self, scene_id, stride=1, min_depth=0.0, max_depth=3.0):
+        # yields (points, colors) per frame in world coordinates
+        backprojector = self.get_backprojector(
+            scene_id, stride, min_depth, max_depth)
+        _, camera_poses = self.get_camera_poses_array(scene_id)
+        return backprojector.project_frames(self.get_frames_rgbd(scene_id), camera_poses)
+
+    def get_pointcloud_arrays(self, scene_id, stride=1, min_depth=0.0, max_depth=3.0):
+        return list(self.iter_pointcloud_arrays(scene_id, stride, min_depth, max_depth))
+
+    def get_pointclouds(self, scene_id, stride=1, min_depth=0.0, max_depth=3.0):
+        return [as_o3d_pointcloud(points, colors) for points, colors
+                in self.iter_pointcloud_arrays(scene_id, stride, min_depth, max_depth)]
+
+    def get_fused_pointcloud(self, scene_id, voxel_size=0.004, stride=1, min_depth=0.0, max_depth=3.0):
+        # streams all frames into a voxel hash, one point per occupied voxel
+        fusion = VoxelFusion(voxel_size)
+        fusion.integrate_frames(self.iter_pointcloud_arrays(
+            scene_id, stride, min_depth, max_depth))
+        return fusion.as_o3d()
+
+    def get_reconstruction_fused_path(self, scene_id):
+        return os.path.join(
+            self.reconstruction_dir, scene_id, self.reconstruction_fused_file)
+
+    def write_fused_pointcloud(self, scene_id, path=None, voxel_size=0.004, stride=1, min_depth=0.0, max_depth=3.0):
+        path = path or self.get_reconstruction_fused_path(scene_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fusion = VoxelFusion(voxel_size)
+        fusion.integrate_frames(self.iter_pointcloud_arrays(
+            scene_id, stride, min_depth, max_depth))
+        fusion.write(path)
+        return path
+
+    def get_reconstruction_inputs(self, scene_id):
+        # files a scene reconstruction depends on
+        return self.get_images_rgb_path(scene_id) + \
+            self.get_images_depth_path(scene_id) + \
+            [self.get_camera_poses_path(scene_id),
+             self.find_camera_info_path(scene_id)]
+
+    def get_reconstruction_manifest(self, scene_id):
+        return ReconstructionManifest(
+            os.path.join(self.reconstruction_dir, scene_id,
+                         self.reconstruction_manifest_file),
+            self.root_dir)
+
+    def has_annotation(self, scene_id):
+        if self.index:
+            return self.index.has_annotation(scene_id)
+
+        return os.path.exists(os.path.join(
+            self.root_dir, self.annotation_dir, scene_id, self.object_pose_file))
+
+    def update_index(self, scene_ids=None):
+        if self.index:
+            self.index.update(scene_ids)
 
     def get_object_poses(self, scene_id):
         full_path = os.path.join(
@@ -360,11 +721,58 @@ class SceneFileReader:
                 f"File {full_path} for visualizing reconstruction does not exist.")
             return None
 
-    def get_reconstruction_align(self, scene_id):
+    def get_reconstruction_visual_lods(self, scene_id):
+        # [(path, triangles)] from the finest to the coarsest level
+        scene_dir = os.path.join(self.reconstruction_dir, scene_id)
+        lods_path = os.path.join(scene_dir, self.reconstruction_visual_lods_file)
+        if os.path.exists(lods_path):
+            with open(lods_path) as fp:
+                lods = json.load(fp)['lods']
+            return [(os.path.join(scene_dir, lod['file']), lod['triangles'])
+                    for lod in lods]
+
+        full_path = os.path.join(scene_dir, self.reconstruction_visual_file)
+        return [(full_path, None)] if os.path.exists(full_path) else []
+
+    def get_reconstruction_visual_lod(self, scene_id, max_triangles=None):
+        # finest level within max_triangles, the coarsest if none fits
+        lods = self.get_reconstruction_visual_lods(scene_id)
+        if not lods:
+            return self.get_reconstruction_visual(scene_id)
+        if max_triangles is None:
+            return MeshReader(lods[0][0])
+
+        path = lods[-1][0]
+        for lod_path, triangles in lods:
+            if triangles is not None and triangles <= max_triangles:
+                path = lod_path
+                break
+        return MeshReader(path)
+
+    def get_reconstruction_align_path(self, scene_id):
         full_path = os.path.join(
             self.reconstruction_dir, scene_id, self.reconstruction_align_file)
+        fused_path = self.get_reconstruction_fused_path(scene_id)
         if(os.path.exists(full_path)):
-            return o3d.io.read_point_cloud(full_path)
+            return full_path
+        elif(os.path.exists(fused_path)):
+            # fused depth frames work as alignment target too
+            return fused_path
         else:
             print(f"File {full_path} for  auto-align does not exist.")
             return None
+
+    def get_reconstruction_align(self, scene_id):
+        path = self.get_reconstruction_align_path(scene_id)
+        if path is None:
+            return None
+        return o3d.io.read_point_cloud(path)
+
+    def get_reconstruction_align_features(self, scene_id, voxel_size=FEATURE_VOXEL_SIZE):
+        # FPFH features of the alignment cloud, cached next to it
+        path = self.get_reconstruction_align_path(scene_id)
+        if path is None:
+            return None
+        return cached_features(os.path.splitext(path)[0] + '_fpfh.npz',
+                               file_key(path, voxel_size),
+                               lambda: o3d.io.read_point_cloud(path), voxel_size)
@@ -0,0 +1,39 @@
+import numpy as np
+
+
+def sharpness(image, stride=2):
+    # variance of the laplacian, higher is sharper
+    image = np.asarray(image)[::stride, ::stride]
+    if image.ndim == 3:
+        image = image[:, :, :3].mean(axis=2)
+    image = image.astype(np.float32)
+    laplacian = image[:-2, 1:-1] + image[2:, 1:-1] + image[1:-1, :-2] + \
+        image[1:-1, 2:] - 4 * image[1:-1, 1:-1]
+    return float(laplacian.var())
+
+
+def motion_segments(trajectory, translation=0.02, rotation=5.0):
+    # segment label per frame, a new segment starts whenever the camera
+    # travelled translation meters or rotated rotation degrees
+    relative = trajectory.relative(1)
+    distances = np.linalg.norm(relative.translations, axis=1)
+    angles = np.degrees(
+        2 * np.arccos(np.clip(np.abs(relative.quaternions[:, 0]), 0, 1)))
+    steps = np.maximum(distances / translation, angles / rotation)
+    return np.floor(np.concatenate(([0], np.cumsum(steps)))).astype(np.int64)
+
+
+def select_keyframes(trajectory, translation=0.02, rotation=5.0, scores=None):
+    # sorted frame indices, one per motion segment: the first frame or the
+    # one with the highest score (e.g. sharpness)
+    if len(trajectory) < 2:
+        return np.arange(len(trajectory))
+
+    labels = motion_segments(trajectory, translation, rotation)
+    if scores is None:
+        _, keys = np.unique(labels, return_index=True)
+    else:
+        order = np.lexsort((-np.asarray(scores), labels))
+        _, first = np.unique(labels[order], return_index=True)
+        keys = order[first]
+    return np.sort(keys)
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+
+from .meshreader import file_hash
+
+
+def config_hash(*values):
+    return hashlib.sha1(json.dumps(values, sort_keys=True).encode()).hexdigest()
+
+
+class ReconstructionManifest:
+    """ Record of what a scene reconstruction was built from.
+
+    Every stage stores a key over the content hashes of its input files, its
+    settings and the key of the stage it depends on. A stage is current if
+    its key is unchanged and its outputs exist. Content hashes are reused
+    from the manifest as long as size and mtime of a file are unchanged.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, root_dir):
+        self.path = path
+        self.root_dir = root_dir
+        self.data = self.load()
+
+    def load(self):
+        empty = {'version': self.VERSION, 'files': {}, 'stages': {}}
+        if not os.path.exists(self.path):
+            return empty
+
+        try:
+            with open(self.path, 'r') as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return empty
+
+        if data.get('version') != self.VERSION:
+            return empty
+        return data
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(self.data, fp, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def fingerprint(self, files):
+        # relative path -> content hash of every input file
+        hashes = {}
+        for file in files:
+            name = os.path.relpath(file, self.root_dir)
+            stat = os.stat(file)
+            entry = self.data['files'].get(name)
+            if entry is None or entry['size'] != stat.st_size or \
+                    entry['mtime'] != stat.st_mtime_ns:
+                entry = {'size': stat.st_size,
+                         'mtime': stat.st_mtime_ns,
+                         'sha1': file_hash(file)}
+                self.data['files'][name] = entry
+            hashes[name] = entry['sha1']
+        return hashes
+
+    def stage_key(self, files=(), config=None, depends=None):
+        dependency = self.data['stages'].get(depends, {}).get('key') \
+            if depends else None
+        return config_hash(self.fingerprint(files), config, dependency)
+
+    def is_current(self, stage, key):
+        entry = self.data['stages'].get(stage)
+        if entry is None or entry['key'] != key:
+            return False
+        outputs = [os.path.join(self.root_dir, x) for x in entry['outputs']]
+        return all(os.path.exists(x) for x in outputs)
+
+    def record(self, stage, key, config=None, outputs=()):
+        self.data['stages'][stage] = {
+            'key': key,
+            'config': config,
+            'outputs': [os.path.relpath(x, self.root_dir) for x in outputs]}
+        self.save()
+
+    def invalidate(self, stage):
+        if self.data['stages'].pop(stage, None) is not None:
+            self.save()
+
+    def __str__(self):
+        return f'manifest_file: {self.path}\n' \
+            f'stages: {", ".join(sorted(self.data["stages"]))}'
@@ -2,28 +2,141 @@ import open3d as o3d
 import trimesh
 import os
 import errno
+import hashlib
+import numpy as np
+import shutil
+import tempfile
+
+MESH_ARRAYS = ('vertices', 'triangles', 'vertex_normals', 'vertex_colors')
+FILE_HASHES = {}
+
+
+def file_hash(file):
+    # content hash, memoized per path, size and mtime
+    stat = os.stat(file)
+    key = (os.path.realpath(file), stat.st_size, stat.st_mtime_ns)
+    if key not in FILE_HASHES:
+        sha1 = hashlib.sha1()
+        with open(file, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b''):
+                sha1.update(chunk)
+        FILE_HASHES[key] = sha1.hexdigest()
+    return FILE_HASHES[key]
 
 
 class MeshReader:
-    def __init__(self, file, scale=1):
+    def __init__(self, file, scale=1, cache_dir=None):
         if(os.path.exists(file)):
             self.file = file  # could check here if file exists
             self.scale = scale
+            self.cache_dir = cache_dir
         else:
             self.file = None
             raise FileNotFoundError(
                 errno.ENOENT, os.strerror(errno.ENOENT), file)
 
     def __str__(self):
-        return 'mesh_file: {self.file}'
+        return f'mesh_file: {self.file}'
 
-    def as_o3d(self):
+    def cache_path(self):
+        # keyed by content and scale, a changed file gets a new entry
+        return os.path.join(self.cache_dir,
+                            f'{file_hash(self.file)}_{float(self.scale)!r}')
+
+    def read_o3d(self):
         return o3d.io.read_triangle_mesh(self.file).scale(self.scale, [0, 0, 0])
 
+    def write_cache(self, mesh):
+        path = self.cache_path()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir)
+        try:
+            for name in MESH_ARRAYS:
+                values = np.asarray(getattr(mesh, name))
+                if len(values):
+                    np.save(os.path.join(tmp_path, name + '.npy'), values)
+            os.replace(tmp_path, path)
+        except OSError:
+            # another process stored the same mesh first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def mark_uncacheable(self):
+        # remembers across sessions that the file needs to be parsed
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            open(self.cache_path() + '.uncacheable', 'w').close()
+        except OSError:
+            pass
+
+    def load_arrays(self):
+        """ Mesh arrays from the binary cache, memory mapped.
+
+        Returns None if caching is disabled or the mesh cannot be cached,
+        e.g. textured meshes.
+        """
+        return self.load_cached()[0]
+
+    def load_cached(self):
+        # (arrays, mesh), mesh is the open3d mesh if the file was parsed
+        # by this call, so callers falling back to it do not parse it again
+        if not self.cache_dir:
+            return None, None
+
+        path = self.cache_path()
+        if os.path.exists(path + '.uncacheable'):
+            return None, None
+        if not os.path.isdir(path):
+            mesh = self.read_o3d()
+            if mesh.has_triangle_uvs():
+                self.mark_uncacheable()
+                return None, mesh
+            try:
+                self.write_cache(mesh)
+            except OSError as e:
+                print(f"Could not cache mesh {self.file}: {e}")
+                return None, mesh
+
+        arrays = {}
+        for name in MESH_ARRAYS:
+            array_file = os.path.join(path, name + '.npy')
+            if os.path.exists(array_file):
+                arrays[name] = np.load(array_file, mmap_mode='c')
+        return arrays, None
+
+    def as_o3d(self):
+        arrays, mesh = self.load_cached()
+        if arrays is None:
+            return mesh if mesh is not None else self.read_o3d()
+
+        mesh = o3d.geometry.TriangleMesh(
+            o3d.utility.Vector3dVector(arrays['vertices']),
+            o3d.utility.Vector3iVector(arrays.get('triangles', np.empty((0, 3), np.int32))))
+        if 'vertex_normals' in arrays:
+            mesh.vertex_normals = o3d.utility.Vector3dVector(
+                arrays['vertex_normals'])
+        if 'vertex_colors' in arrays:
+            mesh.vertex_colors = o3d.utility.Vector3dVector(
+                arrays['vertex_colors'])
+        return mesh
+
     def as_trimesh(self):
-        scale_matrix = trimesh.transformations.scale_matrix(self.scale, [
-                                                            0, 0, 0])
-        return trimesh.load_mesh(self.file).apply_transform(scale_matrix)
+        arrays = self.load_arrays()
+        if arrays is None:
+            scale_matrix = trimesh.transformations.scale_matrix(self.scale, [
+                                                                0, 0, 0])
+            return trimesh.load_mesh(self.file).apply_transform(scale_matrix)
+
+        vertex_normals = None
+        if 'vertex_normals' in arrays:
+            vertex_normals = np.array(arrays['vertex_normals'])
+        vertex_colors = None
+        if 'vertex_colors' in arrays:
+            vertex_colors = np.round(
+                np.asarray(arrays['vertex_colors']) * 255).astype(np.uint8)
+        return trimesh.Trimesh(vertices=np.array(arrays['vertices']),
+                               faces=np.array(arrays.get('triangles', np.empty((0, 3), np.int32))),
+                               vertex_normals=vertex_normals,
+                               vertex_colors=vertex_colors)
 
     def as_bpy_mesh(self):
         import bpy
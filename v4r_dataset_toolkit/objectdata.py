@@ -0,0 +1,141 @@
+import numpy as np
+import open3d as o3d
+import os
+import shutil
+import trimesh
+import yaml
+
+from .features import FEATURE_VOXEL_SIZE, cached_features
+from .meshreader import file_hash
+from .sampling import sample_pointcloud
+
+SAMPLE_DENSITIES = (5000, 10000, 20000)
+LOD_FRACTIONS = (0.5, 0.2, 0.05)
+
+
+class ObjectData:
+    """ Precomputed data derived from an object mesh.
+
+    Holds Poisson-disk samples with normals at several densities, vertex
+    normals, the axis aligned bounding box, a bounding sphere and decimated
+    LOD meshes. Everything is stored in one directory per object and
+    rebuilt when the mesh file hash or the scale changes.
+    """
+
+    def __init__(self, path, mesh, densities=SAMPLE_DENSITIES, lod_fractions=LOD_FRACTIONS):
+        self.path = path
+        self.mesh = mesh  # MeshReader
+        self.densities = tuple(sorted(densities))
+        self.lod_fractions = tuple(lod_fractions)
+        self._meta = None
+
+    def key(self):
+        return {'mesh_hash': file_hash(self.mesh.file),
+                'scale': float(self.mesh.scale),
+                'densities': list(self.densities),
+                'lod_fractions': list(self.lod_fractions)}
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            meta_file = os.path.join(self.path, 'meta.yaml')
+            if os.path.exists(meta_file):
+                with open(meta_file) as fp:
+                    self._meta = yaml.load(fp, Loader=yaml.SafeLoader)
+        return self._meta
+
+    def is_valid(self):
+        meta = self.meta
+        return meta is not None and meta.get('key') == self.key()
+
+    def build(self, force=False):
+        if not force and self.is_valid():
+            return self
+
+        mesh = self.mesh.as_o3d()
+        if not mesh.has_vertex_normals():
+            mesh.compute_vertex_normals()
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path)
+
+        for density in self.densities:
+            pcd = sample_pointcloud(mesh, density, density)
+            np.save(os.path.join(self.path, f'samples_{density}_points.npy'),
+                    np.asarray(pcd.points))
+            np.save(os.path.join(self.path, f'samples_{density}_normals.npy'),
+                    np.asarray(pcd.normals))
+        vertices = np.asarray(mesh.vertices)
+        np.save(os.path.join(self.path, 'vertex_normals.npy'),
+                np.asarray(mesh.vertex_normals))
+
+        lods = []
+        lod = mesh
+        for level, fraction in enumerate(self.lod_fractions):
+            triangles = max(int(len(mesh.triangles) * fraction), 4)
+            lod = lod.simplify_quadric_decimation(
+                target_number_of_triangles=triangles)
+            lod.compute_vertex_normals()
+            o3d.io.write_triangle_mesh(os.path.join(self.path, f'lod_{level}.ply'),
+                                       lod, write_ascii=False, compressed=True)
+            lods.append(len(lod.triangles))
+
+        aabb_min = vertices.min(axis=0)
+        aabb_max = vertices.max(axis=0)
+        center = (aabb_min + aabb_max) / 2
+        meta = {'key': self.key(),
+                'aabb_min': aabb_min.tolist(),
+                'aabb_max': aabb_max.tolist(),
+                'center': center.tolist(),
+                'radius': float(np.linalg.norm(vertices - center, axis=1).max()),
+                'lod_triangles': lods}
+        # meta is written last, an interrupted build stays invalid
+        with open(os.path.join(self.path, 'meta.yaml'), 'w') as fp:
+            yaml.dump(meta, fp, default_flow_style=None)
+        self._meta = meta
+        return self
+
+    def samples(self, number_of_points=10000):
+        # smallest stored density with at least number_of_points points
+        self.build()
+        density = next((d for d in self.densities if d >= number_of_points),
+                       self.densities[-1])
+        pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(
+            np.load(os.path.join(self.path, f'samples_{density}_points.npy'))))
+        pcd.normals = o3d.utility.Vector3dVector(
+            np.load(os.path.join(self.path, f'samples_{density}_normals.npy')))
+        return pcd
+
+    def features(self, voxel_size=FEATURE_VOXEL_SIZE):
+        # FPFH features of the densest samples for global registration
+        self.build()
+        return cached_features(os.path.join(self.path, f'fpfh_{voxel_size}.npz'),
+                               {'voxel_size': voxel_size},
+                               lambda: self.samples(self.densities[-1]), voxel_size)
+
+    def vertex_normals(self):
+        self.build()
+        return np.load(os.path.join(self.path, 'vertex_normals.npy'))
+
+    def aabb(self):
+        self.build()
+        return np.array(self.meta['aabb_min']), np.array(self.meta['aabb_max'])
+
+    def bounding_sphere(self):
+        self.build()
+        return np.array(self.meta['center']), self.meta['radius']
+
+    def lod_path(self, level):
+        self.build()
+        level = min(level, len(self.lod_fractions) - 1)
+        return os.path.join(self.path, f'lod_{level}.ply')
+
+    def lod(self, level):
+        return o3d.io.read_triangle_mesh(self.lod_path(level))
+
+    def lod_trimesh(self, level):
+        return trimesh.load_mesh(self.lod_path(level))
+
+    def __str__(self):
+        return f'path: {self.path}\n' \
+            f'valid: {self.is_valid()}'
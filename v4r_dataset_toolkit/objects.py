@@ -1,20 +1,38 @@
 from collections import UserDict
 import itertools
 import numpy as np
+import open3d as o3d
 import os
 import yaml
 
 from .meshreader import MeshReader
+from .cache import LRUCache
+from .objectdata import ObjectData
+
+
+def geometry_nbytes(mesh):
+    # memory held by an open3d or trimesh mesh
+    if hasattr(mesh, 'faces'):
+        nbytes = mesh.vertices.nbytes + mesh.faces.nbytes + mesh.vertex_normals.nbytes
+        # textured meshes have no vertex colors
+        if mesh.visual.kind == 'vertex':
+            nbytes += mesh.visual.vertex_colors.nbytes
+        return nbytes
+    return sum(np.asarray(getattr(mesh, name)).nbytes
+               for name in ('vertices', 'triangles', 'vertex_normals',
+                            'vertex_colors', 'triangle_normals'))
 
 
 class Object:
-    def __init__(self, id=None, name=None, class_id=None, description=None, mesh_file=None, color=[0, 0, 0], scale=1):
+    def __init__(self, id=None, name=None, class_id=None, description=None, mesh_file=None, color=[0, 0, 0], scale=1,
+                 mesh_cache_dir=None):
         self.id = id
         self.name = name
         self.class_id = class_id
         self.scale = scale
         self.description = description
-        self.mesh = MeshReader(mesh_file, self.scale) if mesh_file else None
+        self.mesh = MeshReader(mesh_file, self.scale,
+                               cache_dir=mesh_cache_dir) if mesh_file else None
         self.color = color
 
     def __str__(self):
@@ -33,11 +51,25 @@ class Object:
 
 
 class ObjectLibrary(UserDict):
+    def __init__(self, *args, geometry_cache_bytes=1 << 30, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.data_dir = None
+        self.object_data = {}
+        # loaded and scaled meshes shared by all consumers of this library
+        self.geometry_cache = LRUCache(maxsize=None,
+                                       maxbytes=geometry_cache_bytes,
+                                       sizeof=geometry_nbytes)
+
     @classmethod
-    def create(cls, path):
+    def create(cls, path, mesh_cache_dir=None, geometry_cache_bytes=1 << 30):
         with open(path) as fp:
             root, _ = os.path.split(path)
-            object_dict = cls()
+            # parsed meshes are cached next to the library by default
+            if mesh_cache_dir is None:
+                mesh_cache_dir = os.path.join(root, '.mesh_cache')
+            object_dict = cls(geometry_cache_bytes=geometry_cache_bytes)
+            # derived per object data is stored next to the library file
+            object_dict.data_dir = os.path.join(root, 'object_data')
             for obj in yaml.load(fp, Loader=yaml.FullLoader):
                 # check mesh
                 mesh = obj.get('mesh')
@@ -50,8 +82,46 @@ class ObjectLibrary(UserDict):
                                                 color=obj.get('color'),
                                                 mesh_file=os.path.join(
                                                     root, mesh) if mesh else None,
-                                                scale=scale if scale else 1)
+                                                scale=scale if scale else 1,
+                                                mesh_cache_dir=mesh_cache_dir)
             return object_dict
 
     def as_list(self, ids=None):
         return list(map(self.__getitem__, ids or [])) or list(self.values())
+
+    def get_geometry(self, id, kind):
+        key = (id, kind)
+        mesh = self.geometry_cache.get(key)
+        if mesh is None:
+            reader = self[id].mesh
+            mesh = reader.as_o3d() if kind == 'o3d' else reader.as_trimesh()
+            self.geometry_cache.put(key, mesh)
+        return mesh
+
+    def get_o3d(self, id, copy=True):
+        """ Scaled open3d mesh of an object.
+
+        With copy=False the shared cached mesh is returned, which must not be
+        modified.
+        """
+        mesh = self.get_geometry(id, 'o3d')
+        return o3d.geometry.TriangleMesh(mesh) if copy else mesh
+
+    def get_trimesh(self, id, copy=True):
+        """ Scaled trimesh of an object, see get_o3d. """
+        mesh = self.get_geometry(id, 'trimesh')
+        return mesh.copy() if copy else mesh
+
+    def geometry_stats(self):
+        return self.geometry_cache.stats()
+
+    def get_object_data(self, id):
+        if id not in self.object_data:
+            self.object_data[id] = ObjectData(
+                os.path.join(self.data_dir, str(id)), self[id].mesh)
+        return self.object_data[id]
+
+    def build_object_data(self, ids=None, force=False):
+        for obj in self.as_list(ids):
+            if obj.mesh:
+                self.get_object_data(obj.id).build(force=force)
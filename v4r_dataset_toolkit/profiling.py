@@ -0,0 +1,113 @@
+import contextlib
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+CLEAR_REFS = '/proc/self/clear_refs'
+STATUS = '/proc/self/status'
+
+
+def read_status(key):
+    # value of a /proc/self/status entry in bytes, None if not available
+    try:
+        with open(STATUS) as fp:
+            for line in fp:
+                if line.startswith(key + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    # resets VmHWM to the current RSS, returns False if not supported
+    try:
+        with open(CLEAR_REFS, 'w') as fp:
+            fp.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    peak = read_status('VmHWM')
+    if peak is None and resource is not None:
+        # peak of the whole process, kilobytes on linux and bytes on macos
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            peak *= 1024
+    return peak
+
+
+class StageProfiler:
+    """ Wall time, CPU time and peak RSS per pipeline stage.
+
+    Stages entered several times, e.g. once per frame, are accumulated. CPU
+    time is the time of the whole process, background threads included.
+    Peak RSS is reset on entering a stage where /proc/self/clear_refs is
+    available, otherwise it is the peak of the whole process so far. Nested
+    stages also raise the peak of their enclosing stages.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._open = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        entry = self.stages.setdefault(
+            name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_rss': None})
+        # the peak so far belongs to the enclosing stages before it is reset
+        self._update_peak(self._open, peak_rss())
+        reset_peak_rss()
+        self._open.append(entry)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield entry
+        finally:
+            entry['calls'] += 1
+            entry['wall'] += time.perf_counter() - wall
+            entry['cpu'] += time.process_time() - cpu
+            self._open.pop()
+            self._update_peak(self._open + [entry], peak_rss())
+
+    def iterate(self, name, items):
+        # times every step of an iterator, e.g. waiting for the next frame
+        items = iter(items)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+            yield item
+
+    def _update_peak(self, entries, peak):
+        if peak is None:
+            return
+        for entry in entries:
+            entry['peak_rss'] = max(entry['peak_rss'] or 0, peak)
+
+    def report(self):
+        return {'stages': self.stages,
+                'peak_rss': max([x['peak_rss'] or 0 for x in self.stages.values()] or [0])}
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fp:
+            json.dump(self.report(), fp, indent=1)
+
+    def __str__(self):
+        lines = [f'{"stage":<16}{"calls":>7}{"wall [s]":>10}{"cpu [s]":>10}{"peak [MB]":>11}']
+        for name, entry in self.stages.items():
+            peak = entry['peak_rss'] / 1024**2 if entry['peak_rss'] else float('nan')
+            lines.append(f'{name:<16}{entry["calls"]:>7}{entry["wall"]:>10.2f}'
+                         f'{entry["cpu"]:>10.2f}{peak:>11.1f}')
+        return '\n'.join(lines)
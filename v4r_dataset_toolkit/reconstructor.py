@@ -1,28 +1,69 @@
 import argparse
 import copy
+import itertools
+import json
 import numpy as np
 import open3d as o3d
 import os
-from scipy.spatial.transform import Rotation as R
 from tqdm import tqdm
 
-from v4r_dataset_toolkit.icp import icp_refinement
+from v4r_dataset_toolkit.backprojection import BackProjector, estimate_roi
+from v4r_dataset_toolkit.frames import FrameSequence, prefetch
+from v4r_dataset_toolkit.icp import PairwiseRefiner
+from v4r_dataset_toolkit.io import CameraInfo, CameraTrajectory
+from v4r_dataset_toolkit.keyframes import sharpness, select_keyframes
+from v4r_dataset_toolkit.profiling import StageProfiler
+from v4r_dataset_toolkit.sampling import create_align_cloud
+from v4r_dataset_toolkit.volume import BlockVolume
+
+
+# settings which change the output of a stage
+INTEGRATE_CONFIG = ("max_depth", "voxel_size", "tsdf_cubic_size", "sdf_trunc",
+                    "icp_refinement", "icp_method", "refine_min_fitness",
+                    "refine_max_rmse", "refine_max_motion",
+                    "roi", "roi_depth_percentile", "roi_margin", "roi_frame_step",
+                    "keyframes", "keyframe_translation", "keyframe_rotation",
+                    "keyframe_sharpness", "checkpoint_interval")
+POSTPROCESS_CONFIG = ("cluster", "simplify", "triangles", "seed",
+                      "align_sampler", "align_voxel_size", "align_points",
+                      "visual_lods")
+VISUAL_LODS = (200000, 50000, 10000)
 
 
 def save_poses(poses, path_groundtruth):
-    with open(path_groundtruth, "w") as fp:
-        for idx, pose in enumerate(poses):
-            pose = np.linalg.inv(pose)
-            quat = R.from_matrix(pose[:3, :3]). as_quat()
-            vals = [str(idx)] + list(np.append(pose[:3, -1], quat).astype(str))
-            fp.write(" ".join(vals) + "\n")
+    # poses are camera extrinsics, the file holds camera poses
+    if not isinstance(poses, CameraTrajectory):
+        poses = CameraTrajectory.from_matrices(poses)
+    poses.inverse().save_txt(path_groundtruth)
+
 
+# resident memory of a spawned refinement worker with numpy and open3d loaded
+REFINE_WORKER_BYTES = 300 * 1024**2
 
-def sample_pointcloud(mesh, uniform_points=4500, poisson_points=4500):
-    pcd = mesh.sample_points_uniformly(number_of_points=uniform_points)
-    pcd = mesh.sample_points_poisson_disk(
-        number_of_points=poisson_points, pcl=pcd)
-    return pcd
+
+def estimate_memory(camera_info, config, frame_cache_size=8):
+    # rough peak memory of one streamed reconstruction in bytes
+    pixels = camera_info.width * camera_info.height
+    # decoded color and depth plus the RGBDImage (uint8 color, float depth)
+    frame = pixels * (3 + 2 + 3 + 4)
+    frames = int(config.get("prefetch_frames", 4)) + frame_cache_size + 2
+    refine = 0
+    if bool(config.get("icp_refinement")):
+        jobs = PairwiseRefiner.jobs_for(config)
+        # up to 2 * jobs frames wait for their pair, each with its cloud of
+        # points and colors in double, which is also sent to a worker
+        refine = 2 * jobs * (frame + pixels * 48)
+        # every registration holds two clouds with points, colors and normals
+        refine += jobs * 2 * pixels * 72
+        if jobs > 1:
+            refine += jobs * REFINE_WORKER_BYTES
+    # the truncation band of one view with margin for the rest of the scene,
+    # each voxel holds tsdf, weight and color as floats
+    voxel_length = float(config.get("tsdf_cubic_size")) / 512.0
+    band = 2 * float(config.get("sdf_trunc")) / voxel_length
+    voxels = 4 * pixels * band
+    # meshing roughly doubles the volume footprint
+    return frame * frames + refine + 2 * 20 * voxels
 
 
 class Reconstructor:
@@ -32,89 +73,433 @@ class Reconstructor:
                  poses=None,
                  intrinsic=None,
                  path_groundtruth=None,
-                 path_dataset=None):
+                 path_dataset=None,
+                 frames=None,
+                 profiler=None):
         self.config = config
         self.color_files = color_files
         self.depth_files = depth_files
+        # optional sequence of (color, depth) pairs, replaces color/depth files
+        self.frames = frames
+        if poses is not None and not isinstance(poses, CameraTrajectory):
+            poses = CameraTrajectory.from_matrices([pose.tf for pose in poses])
         self.poses = poses
         self.intrinsic = intrinsic
         self.path_dataset = path_dataset
         self.path_groundtruth = path_groundtruth
+        self.profiler = profiler or StageProfiler()
+        self.integrate_outputs = []
+        self.postprocess_outputs = []
+        self.roi = None
 
-    def create_reconstruction(self):
-        n_files = len(self.color_files)
+    def get_frames(self):
+        if self.frames is not None:
+            return self.frames
+        return zip(self.color_files, self.depth_files)
+
+    def get_camera_info(self):
+        if self.poses.camera_info is not None:
+            return self.poses.camera_info
+        matrix = self.intrinsic.intrinsic_matrix
+        return CameraInfo(width=self.intrinsic.width, height=self.intrinsic.height,
+                          fx=matrix[0, 0], fy=matrix[1, 1],
+                          cx=matrix[0, 2], cy=matrix[1, 2])
+
+    def get_roi(self):
+        # None (unbounded), an aabb [[xmin, ymin, zmin], [xmax, ymax, zmax]]
+        # from the config, or estimated from poses and depth for "auto"
+        roi = self.config.get("roi")
+        if not roi:
+            return None
+        if roi != "auto":
+            return np.asarray(roi[0], dtype=np.float64), np.asarray(roi[1], dtype=np.float64)
+
+        step = max(int(self.config.get("roi_frame_step", 5)), 1)
+        frames = self.get_frames()
+        if isinstance(frames, FrameSequence):
+            frames = frames[::step]
+        else:
+            frames = itertools.islice(frames, 0, None, step)
+        backprojector = BackProjector(self.get_camera_info(), stride=8,
+                                      max_depth=float(self.config.get("max_depth")))
+        return estimate_roi(backprojector, frames, self.poses.matrices[::step],
+                            depth_percentile=float(
+                                self.config.get("roi_depth_percentile", 90)),
+                            margin=float(self.config.get("roi_margin", 0.05)))
+
+    def get_keyframes(self):
+        # indices of the frames to process, None processes all frames
+        if not self.config.get("keyframes"):
+            return None
+
+        scores = None
+        if self.config.get("keyframe_sharpness"):
+            scores = [sharpness(color) for color, depth
+                      in tqdm(self.get_frames(), total=len(self.poses), desc="Sharpness")]
+        keys = select_keyframes(self.poses,
+                                float(self.config.get("keyframe_translation", 0.02)),
+                                float(self.config.get("keyframe_rotation", 5.0)),
+                                scores)
+        print(f"Selected {len(keys)} of {len(self.poses)} frames")
+        return keys
+
+    def select_frames(self, keys):
+        # frames and camera poses of the keyframes
+        frames = self.get_frames()
+        if keys is None:
+            return frames, self.poses
+        if isinstance(frames, FrameSequence):
+            frames = frames[keys]
+        else:
+            selected = set(keys.tolist())
+            frames = (frame for i, frame in enumerate(frames) if i in selected)
+        return frames, self.poses[keys]
+
+    def iter_rgbds(self, frames=None, trajectory=None, make_rgbd=True):
+        # yields (color, depth, rgbd), rgbd is None unless make_rgbd is set
+        if frames is None:
+            frames, trajectory = self.get_frames(), self.poses
+        depth_trunc = float(self.config.get("max_depth"))
+        cropper = None
+        if self.roi is not None:
+            # depth outside the region of interest never reaches the volume
+            cropper = BackProjector(self.get_camera_info(), max_depth=None)
+        for (color, depth), pose in zip(frames, trajectory.matrices):
+            if cropper is not None:
+                depth = o3d.geometry.Image(cropper.crop_depth(depth, pose, self.roi))
+            rgbd = None
+            if make_rgbd:
+                rgbd = o3d.geometry.RGBDImage.create_from_color_and_depth(
+                    color,
+                    depth,
+                    depth_trunc=depth_trunc,
+                    convert_rgb_to_intensity=False)
+            yield color, depth, rgbd
+
+    def create_volume(self, path=None):
+        voxel_length = float(self.config.get("tsdf_cubic_size")) / 512.0
+        sdf_trunc = float(self.config.get("sdf_trunc"))
+        if not self.checkpoint_interval():
+            return o3d.pipelines.integration.ScalableTSDFVolume(
+                voxel_length=voxel_length,
+                sdf_trunc=sdf_trunc,
+                color_type=o3d.pipelines.integration.TSDFVolumeColorType.RGB8)
+
+        # checkpoints need a volume which can be saved and loaded
+        depth_max = float(self.config.get("max_depth"))
+        if path is not None:
+            return BlockVolume.load(path, voxel_length, sdf_trunc, self.intrinsic,
+                                    depth_max=depth_max)
+        return BlockVolume(voxel_length, sdf_trunc, self.intrinsic,
+                           depth_max=depth_max)
+
+    def checkpoint_interval(self):
+        return int(self.config.get("checkpoint_interval") or 0)
+
+    def checkpoint_dir(self):
+        return os.path.join(self.path_dataset, "checkpoint")
+
+    def frame_keys(self, frames, trajectory):
+        # identifies the integrated frames, appended frames keep the prefix
+        files = frames.files if isinstance(frames, FrameSequence) \
+            else [None] * len(trajectory)
+        return [[str(frame_id), list(file) if isinstance(file, tuple) else file,
+                 pose.flatten().tolist()]
+                for frame_id, file, pose in zip(trajectory.ids, files, trajectory.matrices)]
+
+    def load_checkpoint(self, frame_keys):
+        # returns (volume, state) if the checkpoint covers a prefix of frame_keys
+        state_file = os.path.join(self.checkpoint_dir(), "state.json")
+        if not os.path.exists(state_file):
+            return None, None
+        try:
+            with open(state_file) as fp:
+                state = json.load(fp)
+        except (OSError, ValueError):
+            return None, None
+
+        n_frames = len(state["frames"])
+        if state["config"] != self.stage_config(INTEGRATE_CONFIG) or \
+                state["frames"] != frame_keys[:n_frames]:
+            return None, None
+        volume = self.create_volume(
+            os.path.join(self.checkpoint_dir(), state["volume"]))
+        return volume, state
 
-        volume = o3d.pipelines.integration.ScalableTSDFVolume(
-            voxel_length=float(self.config.get("tsdf_cubic_size")) / 512.0,
-            sdf_trunc=float(self.config.get("sdf_trunc")),
-            color_type=o3d.pipelines.integration.TSDFVolumeColorType.RGB8)
-        voxel_size = float(self.config.get("voxel_size"))
+    def save_checkpoint(self, volume, frame_keys, poses):
+        # the volume file is new for every checkpoint and referenced by the
+        # state, which is replaced last, so an interrupted save is ignored
+        os.makedirs(self.checkpoint_dir(), exist_ok=True)
+        volume_name = f"volume_{len(frame_keys)}.npz"
+        volume.save(os.path.join(self.checkpoint_dir(), volume_name))
+        state = {"config": self.stage_config(INTEGRATE_CONFIG),
+                 "volume": volume_name,
+                 "roi": None if self.roi is None else [x.tolist() for x in self.roi],
+                 "frames": frame_keys,
+                 "poses": poses[:len(frame_keys)].tolist()}
+        state_file = os.path.join(self.checkpoint_dir(), "state.json")
+        with open(state_file + ".tmp", "w") as fp:
+            json.dump(state, fp)
+        os.replace(state_file + ".tmp", state_file)
+        for name in os.listdir(self.checkpoint_dir()):
+            if name.startswith("volume_") and name != volume_name:
+                os.remove(os.path.join(self.checkpoint_dir(), name))
 
-        rgbds = []
-        for i, color_file in enumerate(self.color_files):
-            rgbd_image = o3d.geometry.RGBDImage.create_from_color_and_depth(
-                color_file,
-                self.depth_files[i],
-                depth_trunc=float(self.config.get("max_depth")),
-                convert_rgb_to_intensity=False)
-            rgbds.append(rgbd_image)
+    def stage_config(self, keys):
+        return {key: self.config.get(key) for key in keys}
 
-        poses = [np.linalg.inv(pose.tf) for pose in self.poses]
+    def run(self, manifest=None, input_files=(), force=False):
+        # runs the stages which are out of date, returns their names
+        if manifest is None:
+            self.create_reconstruction()
+            return ["integrate", "postprocess"]
+
+        stages = []
+        config = self.stage_config(INTEGRATE_CONFIG)
+        key = manifest.stage_key(input_files, config)
+        if force or not manifest.is_current("integrate", key):
+            self.integrate()
+            manifest.record("integrate", key, config, self.integrate_outputs)
+            stages.append("integrate")
+
+        config = self.stage_config(POSTPROCESS_CONFIG)
+        key = manifest.stage_key(config=config, depends="integrate")
+        if stages or not manifest.is_current("postprocess", key):
+            self.postprocess()
+            manifest.record("postprocess", key, config,
+                            self.postprocess_outputs)
+            stages.append("postprocess")
+        if stages:
+            self.write_profile()
+        return stages
+
+    def create_reconstruction(self):
+        self.integrate()
+        self.postprocess()
+        self.write_profile()
+
+    def write_profile(self):
+        # wall time, cpu time and peak memory per stage
+        self.profiler.write(os.path.join(self.path_dataset, "reconstruction_profile.json"))
+        print(self.profiler)
+
+    def integrate(self):
+        # integrates all frames and saves the full reconstruction
+        profiler = self.profiler
+        with profiler.stage("keyframes"):
+            frames, trajectory = self.select_frames(self.get_keyframes())
+        poses = trajectory.inverse().matrices.copy()
 
         # TODO: icp refinement does not provide good results for now
-        if bool(self.config.get("icp_refinement")) and self.path_groundtruth[-11:-4] != "refined":
+        refine = bool(self.config.get("icp_refinement")) and \
+            self.path_groundtruth[-11:-4] != "refined"
+        if refine:
             print("ICP refinement")
-            icp_refinement(rgbds, poses, self.intrinsic, config=self.config)
 
-            if bool(self.config.get("save_refined")):
-                save_poses(poses, self.path_groundtruth[:-4] + "_refined.txt")
+        interval = self.checkpoint_interval()
+        start = 0
+        volume = None
+        if interval:
+            frame_keys = self.frame_keys(frames, trajectory)
+            with profiler.stage("checkpoint"):
+                volume, state = self.load_checkpoint(frame_keys)
+            if volume is not None:
+                # continue with the frames appended since the checkpoint
+                start = len(state["frames"])
+                poses[:start] = state["poses"]
+                # the region of the checkpoint keeps appended frames consistent
+                self.roi = None if state["roi"] is None else \
+                    tuple(np.array(x) for x in state["roi"])
+                print(f"Resuming after {start} integrated frames")
+        if volume is None:
+            volume = self.create_volume()
+            with profiler.stage("roi"):
+                self.roi = self.get_roi()
+        if self.roi is not None:
+            print("Region of interest " + np.array2string(self.roi[0], precision=3) +
+                  " - " + np.array2string(self.roi[1], precision=3))
+
+        # with refinement the frame before start is decoded again as reference
+        first = max(start - 1, 0) if refine else start
+        if isinstance(frames, FrameSequence):
+            frames = frames[first:]
+        else:
+            frames = itertools.islice(frames, first, None)
+        rgbds = self.iter_rgbds(frames, trajectory[first:],
+                                make_rgbd=refine or not interval)
+
+        # streaming decodes, preprocesses and integrates one frame at a time,
+        # the next frames are prepared in a background thread meanwhile
+        if self.config.get("streaming", True):
+            rgbds = prefetch(rgbds, int(self.config.get("prefetch_frames", 4)))
+        else:
+            rgbds = list(rgbds)
+
+        def integrate_frame(frame_id, color, depth, rgbd):
+            with profiler.stage("integrate"):
+                if interval:
+                    volume.integrate(color, depth, poses[frame_id])
+                else:
+                    volume.integrate(rgbd, self.intrinsic, poses[frame_id])
+            if interval and (frame_id + 1) % interval == 0:
+                with profiler.stage("checkpoint"):
+                    self.save_checkpoint(volume, frame_keys[:frame_id + 1], poses)
 
-        for frame_id in tqdm(range(n_files), desc="Integration"):
-            volume.integrate(rgbds[frame_id], self.intrinsic, poses[frame_id])
+        refiner = None
+        if refine:
+            # pairs are registered in worker processes while frames are loaded,
+            # a frame is integrated as soon as the pairs up to it are done
+            # frames are registered with their initial extrinsics, on resume the
+            # correction of the reference frame is restored from its refined pose
+            initial = trajectory.inverse().matrices
+            correction = None
+            if start > 0:
+                correction = np.linalg.solve(initial[first], poses[first])
+            refiner = PairwiseRefiner.create(self.intrinsic, self.config, correction)
+        window = 2 * refiner.jobs if refiner else 0
+
+        def integrate_refined(max_pending):
+            with profiler.stage("refine"):
+                results = list(refiner.results(max_pending))
+            for pose, (frame_id, color, depth, rgbd) in results:
+                if frame_id >= start:
+                    poses[frame_id] = pose
+                    integrate_frame(frame_id, color, depth, rgbd)
+
+        try:
+            # load is the time spent waiting for decoded frames
+            for frame_id, (color, depth, rgbd) in enumerate(
+                    tqdm(profiler.iterate("load", rgbds), total=len(poses) - first,
+                         desc="Integration"), first):
+                if refiner is None:
+                    integrate_frame(frame_id, color, depth, rgbd)
+                    continue
+                with profiler.stage("refine"):
+                    refiner.add(rgbd, initial[frame_id], (frame_id, color, depth, rgbd))
+                integrate_refined(window)
+            if refiner is not None:
+                integrate_refined(0)
+        finally:
+            if refiner is not None:
+                refiner.close()
+        if refiner is not None and refiner.rejected:
+            # rejected frames keep the correction of the frame before them
+            print(f"Rejected {len(refiner.rejected)} frame pairs, "
+                  f"first frames: {[first + x for x in refiner.rejected[:10]]}")
+        rgbds = None
+        if interval and start < len(poses):
+            with profiler.stage("checkpoint"):
+                self.save_checkpoint(volume, frame_keys, poses)
+
+        mesh_name = os.path.join(self.path_dataset, "reconstruction.ply")
+        self.integrate_outputs = [mesh_name]
+        if refine and bool(self.config.get("save_refined")):
+            refined_name = self.path_groundtruth[:-4] + "_refined.txt"
+            save_poses(CameraTrajectory.from_matrices(poses, ids=trajectory.ids),
+                       refined_name)
+            self.integrate_outputs.append(refined_name)
 
         print("Meshing out")
-        mesh_full = volume.extract_triangle_mesh()
+        with profiler.stage("meshing"):
+            mesh_full = volume.extract_triangle_mesh()
 
         # save the full reconstruction
-        os.makedirs(self.path_dataset, exist_ok=True)
+        with profiler.stage("write"):
+            os.makedirs(self.path_dataset, exist_ok=True)
+            o3d.io.write_triangle_mesh(mesh_name, mesh_full, False, True)
 
+    def postprocess(self):
+        # derives the alignment cloud and the visual mesh from the saved full
+        # reconstruction, so a rerun of this stage alone gives the same result
+        profiler = self.profiler
         mesh_name = os.path.join(self.path_dataset, "reconstruction.ply")
-        o3d.io.write_triangle_mesh(mesh_name, mesh_full, False, True)
+        with profiler.stage("read"):
+            mesh_full = o3d.io.read_triangle_mesh(mesh_name)
+
+        # seeded sampling makes the outputs reproducible between runs
+        seed = self.config.get("seed", 0)
+        if seed is not None and hasattr(o3d.utility, "random"):
+            o3d.utility.random.seed(int(seed))
 
         # downsample
         cloud_name = os.path.join(
             self.path_dataset, "reconstruction_align.ply")
-        cloud_down = sample_pointcloud(mesh_full, 500000, 500000)
-        o3d.io.write_point_cloud(cloud_name, cloud_down, False, True)
+        with profiler.stage("sampling"):
+            cloud_down = create_align_cloud(
+                mesh_full,
+                self.config.get("align_sampler", "voxel"),
+                voxel_size=float(self.config.get("align_voxel_size", 0.003)),
+                number_of_points=int(self.config.get("align_points", 500000)),
+                seed=self.config.get("seed", 0) or 0)
+        with profiler.stage("write"):
+            o3d.io.write_point_cloud(cloud_name, cloud_down,
+                                     write_ascii=False, compressed=True)
 
         if bool(self.config.get("cluster")):
             print("Clustering mesh.")
-            triangle_clusters, cluster_n_triangles, cluster_area = (
-                mesh_full.cluster_connected_triangles())
-            triangle_clusters = np.asarray(triangle_clusters)
-            cluster_n_triangles = np.asarray(cluster_n_triangles)
+            with profiler.stage("cluster"):
+                triangle_clusters, cluster_n_triangles, cluster_area = (
+                    mesh_full.cluster_connected_triangles())
+                triangle_clusters = np.asarray(triangle_clusters)
+                cluster_n_triangles = np.asarray(cluster_n_triangles)
 
-            # Keep only largest cluster
-            largest_cluster_idx = cluster_n_triangles.argmax()
-            triangles_to_remove = triangle_clusters != largest_cluster_idx
+                # Keep only largest cluster
+                largest_cluster_idx = cluster_n_triangles.argmax()
+                triangles_to_remove = triangle_clusters != largest_cluster_idx
 
-            mesh_full.remove_triangles_by_mask(triangles_to_remove)
+                mesh_full.remove_triangles_by_mask(triangles_to_remove)
 
         if bool(self.config.get("simplify")):
             print("Simplifying " + str(len(mesh_full.vertices)) +
                   " vertices and " + str(len(mesh_full.triangles)) + " triangles")
-            mesh = mesh_full.simplify_quadric_decimation(
-                target_number_of_triangles=int(self.config.get("triangles")))
+            with profiler.stage("simplify"):
+                mesh = mesh_full.simplify_quadric_decimation(
+                    target_number_of_triangles=int(self.config.get("triangles")))
+                mesh.compute_vertex_normals()
             print("Now         " + str(len(mesh.vertices)) +
                   " vertices and " + str(len(mesh.triangles)) + " triangles")
-            mesh.compute_vertex_normals()
         else:
             mesh = mesh_full
 
         # save the simplified reconstruction for visualization
         mesh_name = os.path.join(
             self.path_dataset, "reconstruction_visual.ply")
-        o3d.io.write_triangle_mesh(mesh_name, mesh, False, True)
+        with profiler.stage("write"):
+            o3d.io.write_triangle_mesh(mesh_name, mesh, False, True)
+        with profiler.stage("lods"):
+            lod_outputs = self.write_visual_lods(mesh, mesh_name)
+        self.postprocess_outputs = [cloud_name, mesh_name] + lod_outputs
 
         if bool(self.config.get("debug_mode")):
             o3d.visualization.draw_geometries([mesh])
+
+    def write_visual_lods(self, mesh, mesh_name):
+        # each level is decimated from the previous one, levels which would
+        # not reduce the triangle count are skipped
+        lods = [{"file": os.path.basename(mesh_name),
+                 "triangles": len(mesh.triangles)}]
+        outputs = []
+        for triangles in sorted(self.config.get("visual_lods", VISUAL_LODS), reverse=True):
+            if triangles >= len(mesh.triangles):
+                continue
+            mesh = mesh.simplify_quadric_decimation(
+                target_number_of_triangles=int(triangles))
+            mesh.compute_vertex_normals()
+            lod_name = mesh_name[:-4] + f"_lod{len(lods)}.ply"
+            o3d.io.write_triangle_mesh(lod_name, mesh, False, True)
+            print(f"LOD {len(lods)} with {len(mesh.triangles)} triangles")
+            lods.append({"file": os.path.basename(lod_name),
+                         "triangles": len(mesh.triangles)})
+            outputs.append(lod_name)
+
+        # levels of a previous run which were not written again
+        level = len(lods)
+        while os.path.exists(mesh_name[:-4] + f"_lod{level}.ply"):
+            os.remove(mesh_name[:-4] + f"_lod{level}.ply")
+            level += 1
+
+        lods_name = mesh_name[:-4] + "_lods.json"
+        with open(lods_name + ".tmp", "w") as fp:
+            json.dump({"lods": lods}, fp, indent=1)
+        os.replace(lods_name + ".tmp", lods_name)
+        return outputs + [lods_name]
@@ -0,0 +1,86 @@
+import numpy as np
+
+from .backprojection import as_o3d_pointcloud, voxel_keys
+from .fusion import reduce_by_key
+
+ALIGN_SAMPLERS = ('poisson', 'voxel', 'area')
+
+
+def sample_pointcloud(mesh, uniform_points=4500, poisson_points=4500):
+    pcd = mesh.sample_points_uniformly(number_of_points=uniform_points)
+    pcd = mesh.sample_points_poisson_disk(
+        number_of_points=poisson_points, pcl=pcd)
+    return pcd
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def voxel_vertex_sample(mesh, voxel_size=0.003):
+    # averages vertices, normals and colors of the mesh per voxel
+    if not mesh.has_vertex_normals():
+        mesh.compute_vertex_normals()
+    vertices = np.asarray(mesh.vertices)
+    values = [vertices, np.asarray(mesh.vertex_normals)]
+    if mesh.has_vertex_colors():
+        values.append(np.asarray(mesh.vertex_colors))
+
+    keys, *sums, counts = reduce_by_key(voxel_keys(vertices, voxel_size),
+                                        *values, np.ones(len(vertices)))
+    points = sums[0] / counts[:, None]
+    normals = normalize(sums[1])
+    colors = sums[2] / counts[:, None] if len(sums) > 2 else None
+    return as_o3d_pointcloud(points, colors, normals)
+
+
+def area_sample(mesh, voxel_size=0.003, number_of_points=None, oversample=4, seed=0):
+    # samples triangles proportional to their area, then keeps one point per voxel
+    vertices = np.asarray(mesh.vertices)
+    triangles = np.asarray(mesh.triangles)
+    a, b, c = (vertices[triangles[:, i]] for i in range(3))
+    cross = np.cross(b - a, c - a)
+    areas = np.linalg.norm(cross, axis=1)
+    total = areas.sum()
+    if number_of_points is None:
+        # oversample, so almost every voxel touched by the surface gets a point
+        number_of_points = int(oversample * total / (2 * voxel_size**2))
+
+    # points per triangle, the sorted triangle index keeps memory access local
+    rng = np.random.default_rng(seed)
+    counts = rng.multinomial(number_of_points, areas / total)
+    index = np.repeat(np.arange(len(triangles)), counts)
+    r1 = np.sqrt(rng.random(number_of_points))[:, None]
+    r2 = rng.random(number_of_points)[:, None]
+    weights = np.hstack((1 - r1, r1 * (1 - r2), r1 * r2))
+
+    points = a[index] * weights[:, :1] + b[index] * \
+        weights[:, 1:2] + c[index] * weights[:, 2:]
+    # the sample order is random within a voxel, so thinning picks a random point
+    order = rng.permutation(number_of_points)
+    _, keep = np.unique(voxel_keys(points[order], voxel_size), return_index=True)
+    keep = order[keep]
+    points, index, weights = points[keep], index[keep], weights[keep]
+
+    def interpolate(values):
+        return sum(weights[:, i:i+1] * values[triangles[index, i]] for i in range(3))
+
+    if mesh.has_vertex_normals():
+        normals = normalize(interpolate(np.asarray(mesh.vertex_normals)))
+    else:
+        normals = normalize(cross[index])
+    colors = interpolate(np.asarray(mesh.vertex_colors)) \
+        if mesh.has_vertex_colors() else None
+    return as_o3d_pointcloud(points, colors, normals)
+
+
+def create_align_cloud(mesh, sampler='voxel', voxel_size=0.003, number_of_points=500000, seed=0):
+    if sampler == 'poisson':
+        return sample_pointcloud(mesh, number_of_points, number_of_points)
+    elif sampler == 'voxel':
+        return voxel_vertex_sample(mesh, voxel_size)
+    elif sampler == 'area':
+        return area_sample(mesh, voxel_size, seed=seed)
+    raise ValueError(
+        f"Sampler {sampler} not supported, use one of {ALIGN_SAMPLERS}.")
@@ -0,0 +1,59 @@
+import numpy as np
+import open3d as o3d
+import open3d.core as o3c
+
+
+class BlockVolume:
+    """ TSDF volume on open3d's VoxelBlockGrid.
+
+    Same parameters as the ScalableTSDFVolume used for reconstructions, but
+    the volume can be saved to and loaded from disk, so an integration can
+    be checkpointed and resumed. Frames are raw uint8 color and uint16 depth
+    images with depth in depth_scale units.
+    """
+
+    def __init__(self, voxel_length, sdf_trunc, intrinsic,
+                 depth_scale=1000.0, depth_max=3.0, grid=None):
+        self.voxel_length = voxel_length
+        self.sdf_trunc = sdf_trunc
+        self.intrinsic = o3c.Tensor(intrinsic.intrinsic_matrix, o3c.float64)
+        self.depth_scale = depth_scale
+        self.depth_max = depth_max
+        if grid is None:
+            grid = o3d.t.geometry.VoxelBlockGrid(
+                attr_names=('tsdf', 'weight', 'color'),
+                attr_dtypes=(o3c.float32, o3c.float32, o3c.float32),
+                attr_channels=((1), (1), (3)),
+                voxel_size=voxel_length,
+                block_resolution=16,
+                block_count=10000,
+                device=o3c.Device('CPU:0'))
+        self.grid = grid
+
+    @classmethod
+    def load(cls, path, voxel_length, sdf_trunc, intrinsic, depth_scale=1000.0, depth_max=3.0):
+        return cls(voxel_length, sdf_trunc, intrinsic, depth_scale, depth_max,
+                   grid=o3d.t.geometry.VoxelBlockGrid.load(path))
+
+    def save(self, path):
+        self.grid.save(path)
+
+    def integrate(self, color, depth, extrinsic):
+        depth = o3d.t.geometry.Image(np.ascontiguousarray(depth))
+        color = o3d.t.geometry.Image(np.ascontiguousarray(color))
+        extrinsic = o3c.Tensor(np.asarray(extrinsic), o3c.float64)
+        blocks = self.grid.compute_unique_block_coordinates(
+            depth, self.intrinsic, extrinsic, self.depth_scale, self.depth_max)
+        self.grid.integrate(blocks, depth, color, self.intrinsic, extrinsic,
+                            self.depth_scale, self.depth_max,
+                            self.sdf_trunc / self.voxel_length)
+
+    def extract_triangle_mesh(self):
+        # like the ScalableTSDFVolume, every voxel seen by a frame is meshed,
+        # open3d's default drops surfaces seen by fewer than 3 frames
+        return self.grid.extract_triangle_mesh(weight_threshold=0.0).to_legacy()
+
+    def __str__(self):
+        return f'voxel_length: {self.voxel_length}\n' \
+            f'sdf_trunc: {self.sdf_trunc}\n' \
+            f'blocks: {self.grid.hashmap().size()}'
@@ -0,0 +1,62 @@
+import numpy as np
+
+from .backprojection import voxel_keys
+
+
+class VoxelIndex:
+    """ Voxel hash over a point set for radius queries.
+
+    Points are sorted by the key of their cell, so the points of a cell are
+    one contiguous range found by binary search on the unique keys. A query
+    visits only the cells overlapping the query box, its cost depends on
+    the query size and not on the number of points.
+    """
+
+    # queries covering more cells fall back to scanning all points
+    MAX_QUERY_CELLS = 1 << 18
+
+    def __init__(self, points, cell_size=0.05):
+        self.points = np.asarray(points)
+        self.cell_size = cell_size
+        keys = voxel_keys(self.points, cell_size)
+        self.order = np.argsort(keys, kind='stable')
+        self.keys, self.starts, self.counts = np.unique(
+            keys[self.order], return_index=True, return_counts=True)
+
+    def query_box(self, box_min, box_max):
+        # indices of the points in cells overlapping the box, sorted
+        cell_min = np.floor(np.asarray(box_min) / self.cell_size).astype(np.int64)
+        cell_max = np.floor(np.asarray(box_max) / self.cell_size).astype(np.int64)
+        extent = cell_max - cell_min + 1
+        if np.prod(extent) > min(self.MAX_QUERY_CELLS, len(self.points)):
+            inside = np.all((self.points >= box_min) & (self.points <= box_max), axis=1)
+            return np.flatnonzero(inside)
+
+        axes = [np.arange(a, b + 1) for a, b in zip(cell_min, cell_max)]
+        cells = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+        # the cell centers give the same keys as points inside the cells
+        keys = voxel_keys((cells + 0.5) * self.cell_size, self.cell_size)
+        if len(self.keys) == 0:
+            return np.empty(0, dtype=np.int64)
+        slots = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        slots = slots[self.keys[slots] == keys]
+
+        # concatenated point ranges of the found cells
+        counts = self.counts[slots]
+        offsets = np.repeat(self.starts[slots] - np.cumsum(counts) + counts, counts)
+        return np.sort(self.order[offsets + np.arange(counts.sum())])
+
+    def query_sphere(self, center, radius):
+        # indices of the points within radius of center, sorted
+        center = np.asarray(center, dtype=float)
+        candidates = self.query_box(center - radius, center + radius)
+        distances = np.linalg.norm(self.points[candidates] - center, axis=1)
+        return candidates[distances <= radius]
+
+    def __len__(self):
+        return len(self.points)
+
+    def __str__(self):
+        return f'points: {len(self.points)}\n' \
+            f'cell_size: {self.cell_size}\n' \
+            f'cells: {len(self.keys)}'